@@ -20,17 +20,61 @@ __author__ = "Lorenz A. Kapsner, Moritz Stengel"
 __copyright__ = "Universitätsklinikum Erlangen"
 
 import getpass
+import os
 import requests
+from requests.adapters import HTTPAdapter
 from requests.api import head
 from requests.models import HTTPBasicAuth
+from urllib3.util.retry import Retry
 import json
 import logging
 import urllib.parse as up
 import posixpath
+import threading
+import time
+
+from dqa_mdr_connector.fhir_index import FhirPathIndex
+from dqa_mdr_connector.http_cache import HttpCache
+from dqa_mdr_connector.json_codec import json_loads
+from dqa_mdr_connector.metrics import RequestMetrics, get_body_size, get_endpoint_class
+from dqa_mdr_connector.token_cache import TokenCache
 # api doc: https://rest.demo.dataelementhub.de/swagger-ui/index.html?configUrl=/v3/api-docs/swagger-config
 # dicovery doc: https://www.keycloak.org/docs/4.8/authorization_services/#_service_authorization_api
 
 
+class RateLimiter():
+
+    def __init__(self, requests_per_second: float):
+        # allow at most 'requests_per_second' requests (shared by all threads)
+        self.interval = 1.0 / requests_per_second
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            wait_until = max(self._next, now)
+            self._next = wait_until + self.interval
+        if wait_until > now:
+            time.sleep(wait_until - now)
+
+
+class AuthState():
+
+    def __init__(self):
+        # user and tokens of a connector: copies of the connector (e.g. the
+        # downloads of several namespaces) keep this object, so that tokens
+        # refreshed by one of them are used by all
+        self.username = None
+        self.access_token = None
+        self.refresh_token = None
+        self.access_token_expires = None
+        self.refresh_token_expires = None
+        self.header = None
+        # threading.Lock (or asyncio.Lock) for refreshing the tokens
+        self.lock = None
+
+
 class ApiConnector():
 
     def __init__(
@@ -41,55 +85,441 @@ class ApiConnector():
         api_auth_url: str = None,
         client_id: str = "dehub-dev",
         scope: str = "openid",
-        download: bool = True
+        download: bool = True,
+        timeout: float = 60,
+        retries: int = 5,
+        backoff_factor: float = 0.5,
+        pool_maxsize: int = 10,
+        session: requests.Session = None,
+        cache_dir: str = None,
+        cache_ttl: float = 3600,
+        cache_max_size: int = 512 * 1024 * 1024,
+        cache_revalidate: bool = None,
+        requests_per_second: float = None,
+        credentials_file: str = None,
+        token_cache_file: str = None,
+        token_cache_key: str = None,
+        token_refresh_margin: float = 30,
+        metrics_hook=None,
+        metrics_textfile: str = None
     ):
 
+        self.init_connector(
+            api_url=api_url,
+            namespace_designation=namespace_designation,
+            bypass_auth=bypass_auth,
+            api_auth_url=api_auth_url,
+            client_id=client_id,
+            scope=scope,
+            download=download,
+            timeout=timeout,
+            credentials_file=credentials_file,
+            token_cache_file=token_cache_file,
+            token_cache_key=token_cache_key,
+            token_refresh_margin=token_refresh_margin,
+            metrics_hook=metrics_hook,
+            metrics_textfile=metrics_textfile
+        )
+
+        # one shared http session (connection pooling / keep-alive) for
+        # all requests of this connector and its subclasses
+        if session is None:
+            session = self.get_session(
+                retries=retries,
+                backoff_factor=backoff_factor,
+                pool_maxsize=pool_maxsize
+            )
+        self.session = session
+
+        # optional client-side cap on the request rate
+        if requests_per_second is None:
+            self.rate_limiter = None
+        else:
+            self.rate_limiter = RateLimiter(
+                requests_per_second=requests_per_second)
+
+        # optional on-disk cache for api responses
+        if cache_dir is None:
+            self.cache = None
+        else:
+            self.cache = HttpCache(
+                cache_dir=cache_dir,
+                ttl=cache_ttl,
+                max_size=cache_max_size
+            )
+
+        # cached responses are always revalidated (never used without a
+        # request) by default, when writing to the api: the writes are built
+        # from the current remote data elements
+        self.cache_revalidate = not download if cache_revalidate is None else \
+            cache_revalidate
+
+        self.auth.lock = threading.Lock()
+
+        if bypass_auth:
+            self.cache_scope += "|anonymous"
+        else:
+            # connect to api
+            self.login()
+
+    def init_connector(self, api_url: str, namespace_designation: str, bypass_auth: bool,
+                       api_auth_url: str, client_id: str, scope: str, download: bool,
+                       timeout: float, credentials_file: str, token_cache_file: str,
+                       token_cache_key: str, token_refresh_margin: float, metrics_hook,
+                       metrics_textfile: str):
+        # state of the connector (without any request), shared with the
+        # async connector
+
         # set base url
         self.base_url = api_url
         # set namespace designation
         self.namespace_designation = namespace_designation
+        # set by check_if_namespace_exists
+        self.ns_id = None
+        self.ns_urn = None
+
+        # timeout (in seconds) for every single request
+        self.timeout = timeout
+
+        # counters / latency histograms of all requests; 'metrics_hook' is
+        # called with a dict for every single request and the metrics are
+        # written to 'metrics_textfile' (prometheus format) after each run
+        self.metrics = RequestMetrics(
+            hooks=None if metrics_hook is None else [metrics_hook])
+        self.metrics_textfile = metrics_textfile
 
         if download:
             self.download_role = "READ"
         else:
             self.download_role = "WRITE"
 
-        if bypass_auth:
-            self.header = None
+        # cached responses are only shared within the same auth scope
+        self.cache_scope = "{}|{}|{}".format(client_id, scope, self.download_role)
+
+        self.bypass_auth = bypass_auth
+        self.api_auth_url = api_auth_url
+        self.client_id = client_id
+        self.scope = scope
+        self.credentials_file = credentials_file
+        # user and tokens (set by login)
+        self.auth = AuthState()
+
+        # the access token is refreshed 'token_refresh_margin' seconds
+        # before it expires (and whenever the api answers with 401)
+        self.token_refresh_margin = token_refresh_margin
+
+        # optional encrypted on-disk cache for the tokens
+        if token_cache_file is None:
+            self.token_cache = None
         else:
-            # connect to api
+            self.token_cache = TokenCache(
+                cache_file=token_cache_file,
+                key=token_cache_key
+            )
+
+    def login(self):
+        # the cached tokens are only used for the same user
+        self.auth.username = self.get_username()
+        cached = self.get_cached_tokens()
+        if cached is None:
             self.api_connection = self.get_con(
-                auth_url=api_auth_url,
-                client_id=client_id,
-                scope=scope
+                auth_url=self.api_auth_url,
+                client_id=self.client_id,
+                scope=self.scope
             )
 
             # get tokens from json
-            json_dump = json.loads(self.api_connection.text)
-            #print(json_dump)
-            self.access_token = json_dump["access_token"]
-            self.refresh_token = json_dump["refresh_token"]
+            self.set_tokens(token_response=json_loads(self.api_connection.content))
+        else:
+            self.use_cached_tokens(cached=cached)
+            if self.access_token_expiring():
+                self.refresh_tokens()
+
+        self.cache_scope += "|" + self.auth.username
+
+    def use_cached_tokens(self, cached: dict):
+        logging.info("Using cached tokens of user '{}'.".format(cached["username"]))
+        self.auth.username = cached["username"]
+        self.set_tokens(
+            token_response=cached["tokens"],
+            issued_at=cached["issued_at"]
+        )
 
-            self.header = {"Authorization": "Bearer " + self.access_token}
+    def set_tokens(self, token_response: dict, issued_at: float = None):
+        #print(token_response)
+        self.auth.access_token = token_response["access_token"]
+        self.auth.refresh_token = token_response.get("refresh_token")
+
+        # newly issued tokens are written to the token cache
+        if issued_at is None:
+            issued_at = time.time()
+            self.set_cached_tokens(token_response=token_response, issued_at=issued_at)
+
+        # keycloak sends the lifetimes in seconds ('refresh_expires_in' is
+        # 0 for offline tokens, which do not expire)
+        expires_in = token_response.get("expires_in")
+        self.auth.access_token_expires = None if not expires_in else \
+            issued_at + float(expires_in)
+        refresh_expires_in = token_response.get("refresh_expires_in")
+        self.auth.refresh_token_expires = None if not refresh_expires_in else \
+            issued_at + float(refresh_expires_in)
+
+        self.auth.header = {"Authorization": "Bearer " + self.auth.access_token}
+
+    @property
+    def header(self):
+        # authorization header of the current access token (None, before
+        # login or with bypass_auth)
+        return self.auth.header
+
+    @property
+    def access_token(self):
+        return self.auth.access_token
+
+    @property
+    def refresh_token(self):
+        return self.auth.refresh_token
+
+    def get_token_cache_key(self):
+        return "{}|{}|{}|{}".format(
+            self.api_auth_url, self.client_id, self.scope, self.auth.username)
+
+    def get_cached_tokens(self):
+        if self.token_cache is None:
+            return None
+        cached = self.token_cache.get(self.get_token_cache_key())
+        if cached is None or cached["username"] != self.auth.username:
+            return None
+
+        # unusable, if the refresh token has expired as well
+        refresh_expires_in = cached["tokens"].get("refresh_expires_in")
+        if refresh_expires_in and \
+                time.time() >= cached["issued_at"] + float(refresh_expires_in):
+            return None
+        return cached
+
+    def set_cached_tokens(self, token_response: dict, issued_at: float):
+        if self.token_cache is not None:
+            self.token_cache.set(self.get_token_cache_key(), {
+                "username": self.auth.username,
+                "issued_at": issued_at,
+                "tokens": token_response
+            })
+
+    def access_token_expiring(self):
+        return self.auth.access_token_expires is not None and \
+            time.time() >= self.auth.access_token_expires - self.token_refresh_margin
+
+    def refresh_token_expired(self):
+        return self.auth.refresh_token is None or (
+            self.auth.refresh_token_expires is not None and
+            time.time() >= self.auth.refresh_token_expires)
+
+    def get_refresh_data(self):
+        return {
+            "grant_type": "refresh_token",
+            "client_id": self.client_id,
+            "refresh_token": self.auth.refresh_token
+        }
+
+    def authorize(self, headers: dict):
+        # copy of the request headers with the current access token
+        headers = dict(headers)
+        headers["Authorization"] = self.header["Authorization"]
+        return headers
+
+    def refresh_tokens(self, expired_token: str = None):
+        with self.auth.lock:
+            if expired_token is not None and expired_token != self.auth.access_token:
+                # already refreshed by another thread
+                return
+
+            response = None
+            if not self.refresh_token_expired():
+                logging.info("Refreshing access token.")
+                response = self.check_refresh_response(self.send_request(
+                    method="POST",
+                    url=self.api_auth_url,
+                    data=self.get_refresh_data()
+                ))
+
+            if response is None:
+                # the refresh token has expired as well: log in again
+                response = self.check_login_response(self.get_con(
+                    auth_url=self.api_auth_url,
+                    client_id=self.client_id,
+                    scope=self.scope
+                ))
+
+            self.set_tokens(token_response=json_loads(response.content))
 
     @staticmethod
-    def get_credentials(base_url):
+    def check_refresh_response(response):
+        # None, if the refresh failed (then, the user logs in again)
+        if not response.ok:
+            logging.warning("Refreshing the access token failed ({}).".format(
+                response.status_code))
+            return None
+        return response
+
+    def check_login_response(self, response):
+        if not response.ok:
+            msg = "Login at '{}' failed ({}).".format(
+                self.api_auth_url, response.status_code)
+            logging.error(msg)
+            raise Exception(msg)
+        return response
+
+    def get_username(self):
+        # user of the credentials (only the username is prompted, so that
+        # the password is not asked for, if there are cached tokens)
+        if self.credentials_file is not None or (
+                os.environ.get("DQA_MDR_USERNAME") and os.environ.get("DQA_MDR_PASSWORD")):
+            return self.get_credentials(
+                base_url=self.base_url,
+                credentials_file=self.credentials_file
+            )[0]
+        return input(
+            "Please insert your username for '{}':\n".format(self.base_url))
 
-        username = input(
-            "Please insert your username for '{}':\n".format(base_url))
+    @staticmethod
+    def get_credentials(base_url, credentials_file: str = None, username: str = None):
+
+        # non-interactive runs: json file with "username" and "password" or
+        # the environment variables DQA_MDR_USERNAME and DQA_MDR_PASSWORD
+        if credentials_file is not None:
+            with open(credentials_file, "r", encoding="utf-8") as f:
+                credentials = json.load(f)
+            return credentials["username"], credentials["password"]
+
+        if os.environ.get("DQA_MDR_USERNAME") and os.environ.get("DQA_MDR_PASSWORD"):
+            return os.environ["DQA_MDR_USERNAME"], os.environ["DQA_MDR_PASSWORD"]
+
+        # interactive: the username may have been prompted already
+        if username is None:
+            username = input(
+                "Please insert your username for '{}':\n".format(base_url))
         password = getpass.getpass(
             "\n\nInsert your password for username '{}':\n".format(username))
 
         return username, password
 
+    @staticmethod
+    def get_session(retries: int, backoff_factor: float, pool_maxsize: int):
+        # retry with exponential backoff on connection errors, 429 and 5xx;
+        # only idempotent methods (e.g. GET, PUT) are retried, POST is not
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=[429, 500, 502, 503, 504],
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(
+            max_retries=retry,
+            pool_connections=pool_maxsize,
+            pool_maxsize=pool_maxsize
+        )
+
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers.update({"Accept-Encoding": "gzip, deflate"})
+        return session
+
+    def send_request(self, method: str, url: str, **kwargs):
+        # all http traffic goes through the shared session
+        if self.rate_limiter is not None:
+            self.rate_limiter.wait()
+        kwargs.setdefault("timeout", self.timeout)
+
+        authorized = self.is_authorized(kwargs)
+        if authorized:
+            if self.access_token_expiring():
+                self.refresh_tokens(expired_token=self.auth.access_token)
+            kwargs["headers"] = self.authorize(kwargs["headers"])
+
+        r = self.send_measured_request(method=method, url=url, **kwargs)
+
+        if authorized and r.status_code == 401:
+            # token expired or revoked: refresh it and retry once
+            logging.info("API call unauthorized, refreshing token: {}".format(url))
+            self.refresh_tokens(expired_token=self.get_sent_token(kwargs))
+            kwargs["headers"] = self.authorize(kwargs["headers"])
+            r = self.send_measured_request(method=method, url=url, **kwargs)
+        return r
+
+    @staticmethod
+    def is_authorized(kwargs: dict):
+        # requests to the api (not to the auth server) carry the token
+        return kwargs.get("headers") is not None and \
+            "Authorization" in kwargs["headers"]
+
+    @staticmethod
+    def get_sent_token(kwargs: dict):
+        return kwargs["headers"]["Authorization"][len("Bearer "):]
+
+    def send_measured_request(self, method: str, url: str, **kwargs):
+        start = time.perf_counter()
+        try:
+            r = self.session.request(method=method, url=url, **kwargs)
+        except Exception:
+            self.metrics.record(
+                method=method,
+                endpoint=get_endpoint_class(url=url, base_url=self.base_url),
+                status="error",
+                latency=time.perf_counter() - start,
+                bytes_sent=get_body_size(kwargs.get("data")),
+                url=url
+            )
+            raise
+
+        # retries done by urllib3 for this request
+        retries = getattr(r.raw, "retries", None)
+        self.metrics.record(
+            method=method,
+            endpoint=get_endpoint_class(url=url, base_url=self.base_url),
+            status=r.status_code,
+            latency=time.perf_counter() - start,
+            bytes_sent=get_body_size(r.request.body),
+            bytes_received=len(r.content),
+            retries=0 if retries is None else len(retries.history),
+            url=url
+        )
+        return r
+
+    def write_metrics(self):
+        # at the end of each run
+        for _endpoint in self.metrics.summary():
+            logging.info(
+                "{method} {endpoint}: {requests} requests ({failed} failed, "
+                "{retries} retries), {latency_mean:.3f} s mean latency, "
+                "{bytes_received} bytes received".format(**_endpoint))
+        if self.metrics_textfile is not None:
+            self.metrics.write_prometheus(textfile=self.metrics_textfile)
+
     def get_con(self, auth_url: str, client_id: str, scope: str):
 
         # get discovery document:
         # curl -X GET https://auth.dev.osse-register.de/auth/realms/dehub-demo/.well-known/uma2-configuration
 
-        uname, pw = self.get_credentials(base_url=self.base_url)
+        response = self.send_request(
+            method="POST",
+            url=auth_url,
+            data=self.get_login_data(client_id=client_id, scope=scope)
+        )
+
+        return response
 
-        data = {
+    def get_login_data(self, client_id: str, scope: str):
+        uname, pw = self.get_credentials(
+            base_url=self.base_url,
+            credentials_file=self.credentials_file,
+            username=self.auth.username
+        )
+        self.auth.username = uname
+
+        return {
             "grant_type": "password",
             "client_id": client_id,
             "scope": scope,
@@ -97,74 +527,165 @@ class ApiConnector():
             "password": pw
         }
 
-        response = requests.post(
-            url=auth_url,
-            data=data
-        )
-
-        return response
+    def query_api(self, url, header):
+        if self.cache is not None:
+            return self.query_api_cached(url=url, header=header)
 
-    @staticmethod
-    def query_api(url, header):
         logging.info("API call: {}".format(url))
-        r = requests.get(
+        r = self.send_request(
+            method="GET",
             url=url,
             headers=header
         )
-        j = json.loads(r.text)
+        j = json_loads(r.content)
         return j
 
+    def query_api_cached(self, url, header):
+        key = self.cache.get_key(url=url, scope=self.cache_scope)
+        entry = self.cache.get(key)
+
+        if entry is not None and not self.cache_revalidate and \
+                self.cache.is_fresh(entry):
+            self.cache.count("hits")
+            logging.debug("API call (cached): {}".format(url))
+            return json_loads(entry["body"])
+
+        # revalidate stale entries with etag / last-modified
+        headers = dict(header) if header is not None else {}
+        if entry is not None:
+            if entry["etag"] is not None:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"] is not None:
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        logging.info("API call: {}".format(url))
+        r = self.send_request(
+            method="GET",
+            url=url,
+            headers=headers
+        )
+
+        if r.status_code == 304 and entry is not None:
+            self.cache.count("revalidated")
+            self.cache.touch(key)
+            return json_loads(entry["body"])
+
+        self.cache.count("misses")
+        if r.status_code == 200:
+            self.cache.set(
+                key=key,
+                url=url,
+                body=r.text,
+                etag=r.headers.get("ETag"),
+                last_modified=r.headers.get("Last-Modified")
+            )
+        return json_loads(r.content)
+
+    def invalidate_cache(self, url):
+        # drop a cached response, e.g. after writing to this url
+        if self.cache is not None:
+            self.cache.delete(
+                self.cache.get_key(url=url, scope=self.cache_scope))
+
+    @property
+    def cache_stats(self):
+        # hits, misses and revalidations of the response cache
+        if self.cache is None:
+            return None
+        return dict(self.cache.stats)
+
     def check_if_namespace_exists(self):
         # get namespaces
         response = self.query_api(
             url=self.base_url + "namespaces/",
             header=self.header
         )
+        self.select_namespace(response=response)
 
-        self.ns_id = None
+    def select_namespace(self, response: dict):
+        namespace = self.get_namespace_lookup(response=response).get(
+            self.namespace_designation)
 
-        # print(response)
+        self.ns_id = None if namespace is None else namespace["id"]
+        self.ns_urn = None if namespace is None else namespace["urn"]
 
-        # get namespace ID
-        # solving cardinality
+    def get_namespace_lookup(self, response: dict):
+        # designation -> {"id": ..., "urn": ...} of all released namespaces
+        # (for the download / upload role)
+        self.namespace_lookup = {}
         for _element in response[self.download_role]:
-            # print(_element)
-
+            if _element["identification"]["status"] != "RELEASED":
+                continue
+            # solving cardinality
             for _multi_definitions in _element["definitions"]:
-                if _multi_definitions["designation"] == self.namespace_designation and \
-                        _element["identification"]["status"] == "RELEASED":
-                    self.ns_id = str(_element["identification"]["identifier"])
-                    self.ns_urn = str(_element["identification"]["urn"])
-                    break
+                self.namespace_lookup[_multi_definitions["designation"]] = {
+                    "id": str(_element["identification"]["identifier"]),
+                    "urn": str(_element["identification"]["urn"])
+                }
+        return self.namespace_lookup
 
-    def get_namespace_urns(self, ns_id):
-        # now get all data elements of this namespace
+    def get_namespace_members_url(self, ns_id):
         # set namespace/members url
         self.ns_members_url = up.urljoin(
             self.base_url, posixpath.join("namespaces", ns_id, "members"))
+        return self.ns_members_url
 
+    def get_namespace_members(self, ns_id):
+        # now get all data elements of this namespace
         # get data elements in namespace
         response = self.query_api(
-            url=self.ns_members_url,
+            url=self.get_namespace_members_url(ns_id=ns_id),
             header=self.header
         )
+        return self.select_namespace_members(response=response, ns_id=ns_id)
 
+    @staticmethod
+    def select_namespace_members(response: list, ns_id):
+        # list with released data elements (dicts with "elementUrn", "status"
+        # and, if exposed by the api, "revision")
+        namespace_dataelements = [
+            _element for _element in response if ns_id + ":dataelement:" in _element["elementUrn"] and
+            _element["status"] == "RELEASED"]
+
+        return namespace_dataelements
+
+    def filter_members_by_fhir_path(self, members: list, de_fhir_paths: list,
+                                    fhir_index_file: str, max_workers: int = 1):
+        # use the (incrementally refreshed) fhir-path index to keep only the
+        # data elements with one of the wanted fhir-paths; returns these
+        # members and the elements, which were fetched for the refresh
+        fhir_index = FhirPathIndex(
+            index_file=fhir_index_file,
+            ns_urn=self.ns_urn
+        )
+        fhir_paths = set(de_fhir_paths)
+        fetched = fhir_index.refresh(
+            members=members,
+            get_element=lambda _urn: self.get_element_by_urn(urn=_urn)[0],
+            fhir_paths=fhir_paths,
+            max_workers=max_workers
+        )
+        return fhir_index.filter_members(members=members, fhir_paths=fhir_paths), fetched
+
+    def get_namespace_urns(self, ns_id):
         # list with urns of data elements
         namespace_dataelement_urns = [
-            _element["elementUrn"] for _element in response if ns_id + ":dataelement:" in _element["elementUrn"] and
-            _element["status"] == "RELEASED"]
+            _element["elementUrn"] for _element in self.get_namespace_members(ns_id=ns_id)]
 
         return namespace_dataelement_urns
 
-    def get_element_by_urn(self, urn: str):
+    def get_element_url(self, urn: str):
         # dataelement base url
-        ns_dataelement_url = up.urljoin(
+        return up.urljoin(
             base=self.base_url,
             url=posixpath.join(
                 "element", urn
             )
         )
 
+    def get_element_by_urn(self, urn: str):
+        ns_dataelement_url = self.get_element_url(urn=urn)
+
         response = self.query_api(
             url=ns_dataelement_url,
             header=self.header
@@ -0,0 +1,351 @@
+#!/usr/bin/python
+
+# dqa-mdr-connector: Connecting the MIRACUM-MDR with the DQA-Tool
+# Copyright (C) 2022 Universitätsklinikum Erlangen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+__author__ = "Lorenz A. Kapsner, Moritz Stengel"
+__copyright__ = "Universitätsklinikum Erlangen"
+
+import asyncio
+import logging
+import time
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from dqa_mdr_connector.api_connection import ApiConnector
+from dqa_mdr_connector.fhir_index import FhirPathIndex
+from dqa_mdr_connector.json_codec import json_loads
+from dqa_mdr_connector.metrics import get_body_size, get_endpoint_class
+
+# api doc: https://rest.demo.dataelementhub.de/swagger-ui/index.html?configUrl=/v3/api-docs/swagger-config
+
+
+class AsyncResponse():
+
+    def __init__(self, status_code: int, headers: dict, content: bytes):
+        # the parts of an aiohttp response, which are used by the connector
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8")
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+
+class AsyncApiConnector(ApiConnector):
+
+    def __init__(
+        self,
+        api_url: str,
+        namespace_designation: str,
+        bypass_auth: bool = False,
+        api_auth_url: str = None,
+        client_id: str = "dehub-dev",
+        scope: str = "openid",
+        download: bool = True,
+        timeout: float = 60,
+        retries: int = 5,
+        backoff_factor: float = 0.5,
+        max_in_flight: int = 10,
+        client_session=None,
+        credentials_file: str = None,
+        token_cache_file: str = None,
+        token_cache_key: str = None,
+        token_refresh_margin: float = 30,
+        metrics_hook=None,
+        metrics_textfile: str = None,
+        **kwargs
+    ):
+        # asyncio variant of ApiConnector: the connection (and the login)
+        # is opened with 'await self.open()' or 'async with', all api calls
+        # are coroutines and at most 'max_in_flight' requests are sent at
+        # the same time
+        if aiohttp is None:
+            msg = "The async connector requires the package 'aiohttp' " + \
+                "(pip install dqa_mdr_connector[async])."
+            logging.error(msg)
+            raise Exception(msg)
+
+        # set by GetMDR / UpdateMDR for the thread pool of the sync connector
+        kwargs.pop("pool_maxsize", None)
+        for _arg in kwargs.keys():
+            logging.warning(
+                "Argument '{}' is not supported by the async connector.".format(_arg))
+
+        self.init_connector(
+            api_url=api_url,
+            namespace_designation=namespace_designation,
+            bypass_auth=bypass_auth,
+            api_auth_url=api_auth_url,
+            client_id=client_id,
+            scope=scope,
+            download=download,
+            timeout=timeout,
+            credentials_file=credentials_file,
+            token_cache_file=token_cache_file,
+            token_cache_key=token_cache_key,
+            token_refresh_margin=token_refresh_margin,
+            metrics_hook=metrics_hook,
+            metrics_textfile=metrics_textfile
+        )
+
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.max_in_flight = max_in_flight
+
+        # an aiohttp.ClientSession can be shared by several connectors
+        self.client_session = client_session
+        self._owns_client_session = False
+        # created in self.open() (within the event loop), as the lock of
+        # self.auth
+        self._semaphore = None
+
+        # not supported by the async connector
+        self.session = None
+        self.cache = None
+        self.rate_limiter = None
+
+    async def open(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+            self.auth.lock = asyncio.Lock()
+
+        if self.client_session is None:
+            self.client_session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                connector=aiohttp.TCPConnector(limit=self.max_in_flight)
+            )
+            self._owns_client_session = True
+
+        if not self.bypass_auth and self.header is None:
+            # connect to api
+            await self.login()
+
+    async def close(self):
+        if self._owns_client_session and self.client_session is not None:
+            await self.client_session.close()
+            self.client_session = None
+            self._owns_client_session = False
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def login(self):
+        self.auth.username = self.get_username()
+        cached = self.get_cached_tokens()
+        if cached is None:
+            self.api_connection = await self.get_con(
+                auth_url=self.api_auth_url,
+                client_id=self.client_id,
+                scope=self.scope
+            )
+            self.set_tokens(token_response=json_loads(self.api_connection.content))
+        else:
+            self.use_cached_tokens(cached=cached)
+            if self.access_token_expiring():
+                await self.refresh_tokens()
+
+        self.cache_scope += "|" + self.auth.username
+
+    async def refresh_tokens(self, expired_token: str = None):
+        async with self.auth.lock:
+            if expired_token is not None and expired_token != self.auth.access_token:
+                # already refreshed by another task
+                return
+
+            response = None
+            if not self.refresh_token_expired():
+                logging.info("Refreshing access token.")
+                response = self.check_refresh_response(await self.send_request(
+                    method="POST",
+                    url=self.api_auth_url,
+                    data=self.get_refresh_data()
+                ))
+
+            if response is None:
+                # the refresh token has expired as well: log in again
+                response = self.check_login_response(await self.get_con(
+                    auth_url=self.api_auth_url,
+                    client_id=self.client_id,
+                    scope=self.scope
+                ))
+
+            self.set_tokens(token_response=json_loads(response.content))
+
+    async def send_request(self, method: str, url: str, **kwargs):
+        authorized = self.is_authorized(kwargs)
+        if authorized:
+            if self.access_token_expiring():
+                await self.refresh_tokens(expired_token=self.auth.access_token)
+            kwargs["headers"] = self.authorize(kwargs["headers"])
+
+        r = await self.send_request_with_retries(method=method, url=url, **kwargs)
+
+        if authorized and r.status_code == 401:
+            # token expired or revoked: refresh it and retry once
+            logging.info("API call unauthorized, refreshing token: {}".format(url))
+            await self.refresh_tokens(expired_token=self.get_sent_token(kwargs))
+            kwargs["headers"] = self.authorize(kwargs["headers"])
+            r = await self.send_request_with_retries(method=method, url=url, **kwargs)
+        return r
+
+    async def send_request_with_retries(self, method: str, url: str, **kwargs):
+        # retry with exponential backoff on connection errors, 429 and 5xx;
+        # POST is not retried
+        retry = method != "POST"
+        start = time.perf_counter()
+
+        def _record(status, bytes_received, retries):
+            self.metrics.record(
+                method=method,
+                endpoint=get_endpoint_class(url=url, base_url=self.base_url),
+                status=status,
+                latency=time.perf_counter() - start,
+                bytes_sent=get_body_size(kwargs.get("data")),
+                bytes_received=bytes_received,
+                retries=retries,
+                url=url
+            )
+
+        for _attempt in range(self.retries + 1):
+            try:
+                async with self._semaphore:
+                    async with self.client_session.request(
+                            method=method, url=url, **kwargs) as r:
+                        response = AsyncResponse(
+                            status_code=r.status,
+                            headers=r.headers,
+                            content=await r.read()
+                        )
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if not retry or _attempt == self.retries:
+                    _record(status="error", bytes_received=0, retries=_attempt)
+                    raise
+                logging.warning("API call failed, retrying: {} ({})".format(url, e))
+            else:
+                if not retry or _attempt == self.retries or \
+                        response.status_code not in [429, 500, 502, 503, 504]:
+                    _record(
+                        status=response.status_code,
+                        bytes_received=len(response.content),
+                        retries=_attempt
+                    )
+                    return response
+                logging.warning("API call failed, retrying: {} ({})".format(
+                    url, response.status_code))
+
+            await asyncio.sleep(self.backoff_factor * (2 ** _attempt))
+
+    async def get_con(self, auth_url: str, client_id: str, scope: str):
+        return await self.send_request(
+            method="POST",
+            url=auth_url,
+            data=self.get_login_data(client_id=client_id, scope=scope)
+        )
+
+    async def query_api(self, url, header):
+        logging.info("API call: {}".format(url))
+        r = await self.send_request(
+            method="GET",
+            url=url,
+            headers=header
+        )
+        return json_loads(r.content)
+
+    async def check_if_namespace_exists(self):
+        # get namespaces
+        response = await self.query_api(
+            url=self.base_url + "namespaces/",
+            header=self.header
+        )
+        self.select_namespace(response=response)
+
+    async def get_namespace_members(self, ns_id):
+        response = await self.query_api(
+            url=self.get_namespace_members_url(ns_id=ns_id),
+            header=self.header
+        )
+        return self.select_namespace_members(response=response, ns_id=ns_id)
+
+    async def filter_members_by_fhir_path(self, members: list, de_fhir_paths: list,
+                                          fhir_index_file: str, max_workers: int = 1):
+        # as ApiConnector.filter_members_by_fhir_path, the new or changed
+        # data elements are fetched at once
+        fhir_index = FhirPathIndex(
+            index_file=fhir_index_file,
+            ns_urn=self.ns_urn
+        )
+        fhir_paths = set(de_fhir_paths)
+        refresh_urns = fhir_index.get_refresh_urns(members=members)
+
+        async def _get_element(urn):
+            try:
+                return (await self.get_element_by_urn(urn=urn))[0]
+            except Exception as e:
+                logging.error("Failed to fetch dataelement '{}': {}".format(urn, e))
+                return None
+
+        responses = await asyncio.gather(*[_get_element(_urn) for _urn in refresh_urns])
+        fetched = fhir_index.update(
+            members=members,
+            responses=dict(zip(refresh_urns, responses)),
+            fhir_paths=fhir_paths
+        )
+        return fhir_index.filter_members(members=members, fhir_paths=fhir_paths), fetched
+
+    async def get_namespace_urns(self, ns_id):
+        return [_element["elementUrn"] for _element in
+                await self.get_namespace_members(ns_id=ns_id)]
+
+    async def get_element_by_urn(self, urn: str):
+        ns_dataelement_url = self.get_element_url(urn=urn)
+
+        response = await self.query_api(
+            url=ns_dataelement_url,
+            header=self.header
+        )
+        # get data element metadata
+        return response, ns_dataelement_url
+
+    async def post_to_api(self, url, data, header):
+        logging.info("API post: {}".format(url))
+        return await self.send_request(
+            method="POST",
+            url=url,
+            data=data,
+            headers=header
+        )
+
+    async def put_to_api(self, url, data, header):
+        logging.info("API put: {}".format(url))
+        return await self.send_request(
+            method="PUT",
+            url=url,
+            data=data,
+            headers=header
+        )
@@ -0,0 +1,175 @@
+#!/usr/bin/python
+
+# dqa-mdr-connector: Connecting the MIRACUM-MDR with the DQA-Tool
+# Copyright (C) 2022 Universitätsklinikum Erlangen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+__author__ = "Lorenz A. Kapsner, Moritz Stengel"
+__copyright__ = "Universitätsklinikum Erlangen"
+
+import asyncio
+import posixpath
+import logging
+from collections import deque
+
+from dqa_mdr_connector.async_connection import AsyncApiConnector
+from dqa_mdr_connector.get_mdr import GetMDR
+
+
+class AsyncGetMDR(GetMDR, AsyncApiConnector):
+
+    # same arguments as GetMDR (max_in_flight instead of max_workers);
+    # the download is started with 'await gm()'
+
+    async def __call__(self):
+        await self.open()
+        try:
+            if self.namespace_designations is None:
+                await self.download()
+            else:
+                await self.download_namespaces()
+        finally:
+            self.write_metrics()
+            await self.close()
+
+        return self.finish()
+
+    async def download(self, check_namespace: bool = True):
+        if self.return_csv and self.stream:
+            with self.csv_row_writer() as row_writer:
+                await self.query_info_from_api(
+                    row_writer=row_writer, check_namespace=check_namespace)
+        else:
+            await self.query_info_from_api(check_namespace=check_namespace)
+
+    async def download_namespaces(self):
+        response = await self.query_api(
+            url=self.base_url + "namespaces/",
+            header=self.header
+        )
+        self.select_namespace_downloads(response=response)
+
+        await asyncio.gather(*[
+            _gm.download(check_namespace=False)
+            for _gm in self.namespace_downloads.values()])
+
+        self.combine_namespace_downloads()
+
+    async def query_info_from_api(self, row_writer=None, check_namespace: bool = True):
+        # if namespace exists, self.ns_id will be set
+        if check_namespace:
+            await self.check_if_namespace_exists()
+        self.check_namespace_found()
+
+        namespace_dataelements = await self.get_namespace_members(ns_id=self.ns_id)
+        self.value_domains = {}
+
+        if self.de_fhir_paths is not None and self.fhir_index_file is not None:
+            namespace_dataelements, self.prefetched = await self.filter_members_by_fhir_path(
+                members=namespace_dataelements,
+                de_fhir_paths=self.de_fhir_paths,
+                fhir_index_file=self.fhir_index_file
+            )
+
+        previous_state, fetch_urns = self.select_fetch_urns(
+            namespace_dataelements=namespace_dataelements)
+
+        # the rows are collected (and written) in a worker thread, while the
+        # elements are fetched in this event loop
+        await asyncio.to_thread(
+            self.collect_rows,
+            namespace_dataelements=namespace_dataelements,
+            previous_state=previous_state,
+            fetch_urns=fetch_urns,
+            fetched_rows=self.iter_elements(
+                urns=fetch_urns, loop=asyncio.get_running_loop()),
+            row_writer=row_writer
+        )
+
+    def iter_elements(self, urns: list, loop):
+        # as GetMDR.iter_elements (called from a worker thread): yields the
+        # rows of each urn in the order of 'urns', at most 4 * max_in_flight
+        # elements are fetched ahead (so that not all rows are kept in memory)
+        pending = deque()
+        try:
+            for _urn in urns:
+                pending.append(asyncio.run_coroutine_threadsafe(
+                    self.get_element_rows(urn=_urn), loop))
+                if len(pending) >= 4 * self.max_in_flight:
+                    yield pending.popleft().result()
+            while len(pending) > 0:
+                yield pending.popleft().result()
+        finally:
+            # collect_rows failed: do not fetch the remaining elements
+            for _future in pending:
+                _future.cancel()
+
+    async def get_element_rows(self, urn: str):
+        if self.journal is not None and urn in self.journal.fetched:
+            return self.journal.fetched[urn]
+
+        try:
+            element_rows = self.fetched_to_rows(fetched=await self.fetch_element(urn=urn))
+        except Exception as e:
+            logging.error("Failed to fetch dataelement '{}': {}".format(urn, e))
+            return None
+
+        if self.journal is not None:
+            self.journal.record_fetched(urn=urn, data=element_rows)
+        return element_rows
+
+    async def fetch_element(self, urn: str):
+        ns_dataelement_url = self.get_element_url(urn=urn)
+        # element was already fetched while refreshing the fhir-path index
+        response = self.prefetched.pop(urn, None)
+        if response is None:
+            response, ns_dataelement_url = await self.get_element_by_urn(urn=urn)
+
+        fhir_path = self.get_fhir_path_slots(response=response)
+        if not self.is_wanted(fhir_path=fhir_path):
+            # skip, if this dataelement is not wanted
+            return None
+
+        response_valuedom = await self.get_value_domain(
+            value_domain_urn=response.get("valueDomainUrn"),
+            ns_dataelement_url=ns_dataelement_url
+        )
+
+        return response, fhir_path, response_valuedom
+
+    async def get_value_domain(self, value_domain_urn: str, ns_dataelement_url: str):
+        # all data elements with the same value domain await the same task
+        ns_dataelement_valuedom_url = posixpath.join(ns_dataelement_url, "valuedomain")
+
+        if value_domain_urn is None:
+            return await self.query_api(
+                url=ns_dataelement_valuedom_url,
+                header=self.header
+            )
+
+        task = self.value_domains.get(value_domain_urn)
+        if task is None:
+            task = asyncio.ensure_future(self.query_api(
+                url=ns_dataelement_valuedom_url,
+                header=self.header
+            ))
+            self.value_domains[value_domain_urn] = task
+        try:
+            return await task
+        except Exception:
+            # not memoized, the next data element tries again
+            if self.value_domains.get(value_domain_urn) is task:
+                del self.value_domains[value_domain_urn]
+            raise
@@ -0,0 +1,204 @@
+#!/usr/bin/python
+
+# dqa-mdr-connector: Connecting the MIRACUM-MDR with the DQA-Tool
+# Copyright (C) 2022 Universitätsklinikum Erlangen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+__author__ = "Lorenz A. Kapsner, Moritz Stengel"
+__copyright__ = "Universitätsklinikum Erlangen"
+
+import asyncio
+import logging
+import pandas as pd
+
+from dqa_mdr_connector.async_connection import AsyncApiConnector
+from dqa_mdr_connector.json_codec import json_body
+from dqa_mdr_connector.update_mdr import UpdateMDR
+
+
+class AsyncUpdateMDR(UpdateMDR, AsyncApiConnector):
+
+    # same arguments as UpdateMDR (max_in_flight instead of max_workers);
+    # the upload is started with 'await um()'. Only the requests are
+    # awaited here, everything else is done by UpdateMDR
+
+    async def __call__(self):
+        await self.open()
+        self.start_run()
+        completed = False
+        try:
+            results = await self.update_namespace()
+            completed = True
+        finally:
+            self.end_run(completed=completed)
+            await self.close()
+
+        return results
+
+    async def update_namespace(self):
+        urn_designation_mapping = await self.read_namespace()
+        if self.ns_id is None:
+            await self.create_namespace()
+
+        # update existing / create new dataelements; the number of requests
+        # in flight is bounded by max_in_flight
+        rows, build_request, _ = self.prepare_upload(
+            urn_designation_mapping=urn_designation_mapping)
+        results = await asyncio.gather(*[
+            self.upload_row(_row=_row, build_request=build_request) for _row in rows])
+
+        return self.summarize(results=results)
+
+    async def create_namespace(self):
+        response = await self.post_to_api(
+            url=self.base_url + "namespaces/",
+            data=json_body(self.get_namespace_payload()),
+            header=self.header
+        )
+        logging.info("Namespace created: {}".format(response.status_code))
+
+        # now, namespace exists, set self.ns_id
+        await self.check_if_namespace_exists()
+
+    async def read_namespace(self):
+        urn_designation_mapping = {}
+
+        # if namespace exists, self.ns_id is set
+        await self.check_if_namespace_exists()
+
+        if self.ns_id is not None:
+            logging.info("Namespace '{}' already exists.\n".format(
+                self.namespace_designation))
+            namespace_dataelements = await self.get_namespace_members(
+                ns_id=self.ns_id)
+
+            prefetched = {}
+            if self.use_fhir_index():
+                namespace_dataelements, prefetched = await self.filter_members_by_fhir_path(
+                    members=namespace_dataelements,
+                    de_fhir_paths=self.de_fhir_paths,
+                    fhir_index_file=self.fhir_index_file
+                )
+
+            urns = [_member["elementUrn"] for _member in namespace_dataelements]
+            responses = await asyncio.gather(
+                *[self.get_element(urn=_urn, prefetched=prefetched) for _urn in urns])
+
+            for _urn, _response in zip(urns, responses):
+                self.register_element(
+                    urn=_urn,
+                    response=_response,
+                    urn_designation_mapping=urn_designation_mapping
+                )
+
+        return urn_designation_mapping
+
+    async def get_element(self, urn: str, prefetched: dict):
+        response = self.get_known_element(urn=urn, prefetched=prefetched)
+        if response is not None:
+            return response
+        response, ns_dataelement_url = await self.get_element_by_urn(urn=urn)
+        return self.record_element(urn=urn, response=response)
+
+    async def save_snapshot(self, snapshot_file: str):
+        await self.open()
+        self.open_element_store()
+        try:
+            self.write_snapshot(
+                snapshot_file=snapshot_file,
+                urn_designation_mapping=await self.read_namespace()
+            )
+        finally:
+            self.element_store.close()
+            await self.close()
+
+    async def plan(self, snapshot_file: str = None, plan_file: str = None):
+        self.open_element_store()
+        try:
+            if snapshot_file is None:
+                await self.open()
+                try:
+                    urn_designation_mapping = await self.read_namespace()
+                finally:
+                    await self.close()
+            else:
+                urn_designation_mapping = self.read_snapshot(snapshot_file=snapshot_file)
+            return self.make_plan(
+                urn_designation_mapping=urn_designation_mapping,
+                plan_file=plan_file
+            )
+        finally:
+            self.element_store.close()
+
+    async def apply_plan(self, plan):
+        plan = self.read_plan(plan=plan)
+
+        await self.open()
+        self.start_run(journal_identity=self.get_plan_identity(plan=plan))
+        completed = False
+        try:
+            results = await self.apply_changes(changes=plan["changes"])
+            completed = True
+        finally:
+            self.end_run(completed=completed)
+            await self.close()
+
+        return results
+
+    async def apply_changes(self, changes: list):
+        await self.check_if_namespace_exists()
+        if self.ns_id is None:
+            await self.create_namespace()
+
+        return self.summarize(results=await asyncio.gather(
+            *[self.apply_change(change=_change) for _change in changes]))
+
+    async def apply_change(self, change: dict):
+        result, request = self.prepare_change(change=change)
+        if result is not None:
+            return result
+        return await self.send_change(request=request)
+
+    async def upload_row(self, _row: pd.Series, build_request):
+        result, request = self.prepare_row(_row=_row, build_request=build_request)
+        if result is not None:
+            return result
+        return await self.send_change(request=request)
+
+    async def send_change(self, request: dict):
+        try:
+            response = await self.write_change(request=request)
+        except Exception as e:
+            return self.get_failed_result(_row=request, error=e)
+        return self.get_response_result(request=request, response=response)
+
+    async def write_change(self, request: dict):
+        if request["method"] == "PUT":
+            return await self.put_to_api(
+                url=request["url"],
+                data=json_body(request["payload"]),
+                header=self.header
+            )
+        if request["method"] == "POST":
+            return await self.post_to_api(
+                url=request["url"],
+                data=json_body(request["payload"]),
+                header=self.header
+            )
+        return None
+
+    # UpdateMDR defines blocking versions of these
+    post_to_api = AsyncApiConnector.post_to_api
+    put_to_api = AsyncApiConnector.put_to_api
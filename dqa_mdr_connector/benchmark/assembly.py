@@ -0,0 +1,96 @@
+#!/usr/bin/python
+
+# dqa-mdr-connector: Connecting the MIRACUM-MDR with the DQA-Tool
+# Copyright (C) 2022 Universitätsklinikum Erlangen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+__author__ = "Lorenz A. Kapsner, Moritz Stengel"
+__copyright__ = "Universitätsklinikum Erlangen"
+
+# scaling benchmark of assembling the downloaded MDR in GetMDR (without any
+# request): the time per element should stay about the same for all sizes,
+# run from root directory:
+# python -m dqa_mdr_connector.benchmark.assembly --sizes 1000 10000 100000
+
+import argparse
+import logging
+import time
+
+import pandas as pd
+
+from dqa_mdr_connector.benchmark.mock_hub import get_value_domains, make_dataelement
+from dqa_mdr_connector.get_mdr import GetMDR
+
+
+def benchmark_assembly(size: int):
+    gm = GetMDR(
+        return_csv=False,
+        api_url="http://127.0.0.1/v1/",
+        bypass_auth=True,
+        namespace_designation="benchmark"
+    )
+
+    # the responses of 'size' data elements (with their value domains)
+    value_domains = get_value_domains()
+    elements = [make_dataelement(ns_id="1", index=_i) for _i in range(size)]
+    members = [{"elementUrn": _e["identification"]["urn"], "status": "RELEASED",
+                "revision": 1} for _e in elements]
+    fetch_urns = [_member["elementUrn"] for _member in members]
+
+    # rows of each data element (dqa slot expanded)
+    start = time.perf_counter()
+    fetched_rows = [
+        gm.element_to_rows(
+            response=_element,
+            fhir_path=[],
+            response_valuedom=value_domains[_i % len(value_domains)]
+        ) for _i, _element in enumerate(elements)]
+    expand_time = time.perf_counter() - start
+
+    # one table of all rows
+    start = time.perf_counter()
+    gm.collect_rows(
+        namespace_dataelements=members,
+        previous_state={},
+        fetch_urns=fetch_urns,
+        fetched_rows=fetched_rows
+    )
+    collect_time = time.perf_counter() - start
+
+    return {
+        "benchmark": "Assembly",
+        "elements": size,
+        "rows": len(gm.database),
+        "expand_time": expand_time,
+        "collect_time": collect_time,
+        "us_per_element": (expand_time + collect_time) * 1e6 / size
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark assembling the downloaded MDR table of GetMDR.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="number of data elements")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    results = [benchmark_assembly(size=_size) for _size in args.sizes]
+    print(pd.DataFrame(results).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+#!/usr/bin/python
+
+# dqa-mdr-connector: Connecting the MIRACUM-MDR with the DQA-Tool
+# Copyright (C) 2022 Universitätsklinikum Erlangen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+__author__ = "Lorenz A. Kapsner, Moritz Stengel"
+__copyright__ = "Universitätsklinikum Erlangen"
+
+import json
+import random
+import threading
+import time
+import urllib.parse as up
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# value domains of the generated data elements (one per variable type)
+__value_domains = [
+    {"type": "STRING", "text": {"useRegEx": False, "regEx": "",
+                                "useMaximumLength": True, "maximumLength": 0}},
+    {"type": "NUMERIC", "numeric": {"type": "INTEGER", "useMinimum": True,
+                                    "useMaximum": True, "unitOfMeasure": "",
+                                    "minimum": 0, "maximum": 100}},
+    {"type": "NUMERIC", "numeric": {"type": "FLOAT", "useMinimum": True,
+                                    "useMaximum": True, "unitOfMeasure": "kg",
+                                    "minimum": 0, "maximum": 500}},
+    {"type": "DATETIME", "datetime": {"date": "ISO_8601", "time": "NONE",
+                                      "hourFormat": ""}},
+    {"type": "ENUMERATED", "permittedValues": []}
+]
+
+
+def get_value_domains():
+    return __value_domains
+
+
+def make_dataelement(ns_id: str, index: int, revision: int = 1):
+    # data element with a dqa slot for two systems and a fhir-path slot,
+    # similar to the ones created by UpdateMDR
+    urn = "urn:{}:dataelement:{}:{}".format(ns_id, index, revision)
+    dqa_slot = {"available_systems": {
+        "postgres": {"i2b2": {
+            "dqa_assessment": 1,
+            "data_map": "",
+            "filter": "",
+            "source_variable_name": "variable_{}".format(index),
+            "source_table_name": "observation_fact",
+            "constraints": "",
+            "plausibility_relation": "",
+            "restricting_date_var": "start_date",
+            "restricting_date_format": ""
+        }},
+        "csv": {"p21csv": {
+            "dqa_assessment": 1,
+            "data_map": "",
+            "filter": "",
+            "source_variable_name": "VARIABLE_{}".format(index),
+            "source_table_name": "FALL.CSV",
+            "constraints": "",
+            "plausibility_relation": "",
+            "restricting_date_var": "",
+            "restricting_date_format": ""
+        }}
+    }}
+    return {
+        "identification": {
+            "elementType": "DATAELEMENT",
+            "namespaceUrn": "urn:{}:namespace:1".format(ns_id),
+            "status": "RELEASED",
+            "urn": urn,
+            "revision": revision
+        },
+        "definitions": [{
+            "designation": "Dataelement {}".format(index),
+            "definition": "Definition of dataelement {}".format(index),
+            "language": "en"
+        }],
+        "slots": [
+            {"name": "dqa", "value": json.dumps(dqa_slot)},
+            {"name": "fhir-path", "value": "Observation.element{}".format(index)}
+        ],
+        "valueDomainUrn": "urn:{}:valuedomain:{}:1".format(
+            ns_id, index % len(get_value_domains()))
+    }
+
+
+class MockHub():
+
+    def __init__(self, size: int = 100, latency: float = 0.0,
+                 error_rate: float = 0.0, namespace_designation: str = "benchmark",
+                 namespaces: int = 1, seed: int = 0, host: str = "127.0.0.1",
+                 port: int = 0):
+        # local stand-in for the DataElementHub endpoints used by the
+        # connector; every response is delayed by 'latency' seconds and a
+        # share of 'error_rate' requests fails with 503. There are
+        # 'namespaces' namespaces with 'size' data elements each
+        # (designations "benchmark", "benchmark_2", ...)
+        self.size = size
+        self.latency = latency
+        self.error_rate = error_rate
+        self.namespace_designation = namespace_designation
+        self.ns_id = "1"
+        self.namespaces = {"1": namespace_designation}
+        for _i in range(2, namespaces + 1):
+            self.namespaces[str(_i)] = "{}_{}".format(namespace_designation, _i)
+
+        self.random = random.Random(seed)
+        self.requests = {}
+        self._lock = threading.Lock()
+
+        # urn -> data element
+        self.elements = {}
+        for _ns_id in self.namespaces.keys():
+            for _i in range(size):
+                _element = make_dataelement(ns_id=_ns_id, index=_i)
+                self.elements[_element["identification"]["urn"]] = _element
+        self.next_index = size
+
+        self.server = ThreadingHTTPServer((host, port), self.get_handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def api_url(self):
+        return "http://{}:{}/v1/".format(*self.server.server_address[:2])
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def count(self, method: str):
+        with self._lock:
+            self.requests[method] = self.requests.get(method, 0) + 1
+
+    def fail(self):
+        with self._lock:
+            return self.random.random() < self.error_rate
+
+    def get_namespaces(self):
+        namespaces = [{
+            "identification": {
+                "elementType": "NAMESPACE",
+                "status": "RELEASED",
+                "identifier": int(_ns_id),
+                "urn": "urn:{}:namespace:1".format(_ns_id)
+            },
+            "definitions": [{
+                "designation": _designation,
+                "definition": "Benchmark namespace",
+                "language": "en"
+            }]
+        } for _ns_id, _designation in self.namespaces.items()]
+        return {"READ": namespaces, "WRITE": namespaces, "ADMIN": namespaces}
+
+    def get_members(self, ns_id: str):
+        prefix = "urn:{}:".format(ns_id)
+        with self._lock:
+            return [{
+                "elementUrn": _urn,
+                "status": _element["identification"]["status"],
+                "revision": _element["identification"]["revision"]
+            } for _urn, _element in self.elements.items() if _urn.startswith(prefix)]
+
+    def handle(self, method: str, path: str, body: bytes):
+        # returns status code, json body and extra headers
+        parts = [_p for _p in up.urlparse(path).path.split("/") if _p][1:]
+
+        if method == "GET" and parts == ["namespaces"]:
+            return 200, self.get_namespaces(), {}
+
+        if method == "GET" and len(parts) == 3 and parts[0] == "namespaces" and \
+                parts[2] == "members":
+            return 200, self.get_members(ns_id=parts[1]), {}
+
+        if len(parts) >= 2 and parts[0] == "element":
+            urn = parts[1]
+            with self._lock:
+                element = self.elements.get(urn)
+            if element is None:
+                return 404, {"error": "not found"}, {}
+            if method == "GET" and len(parts) == 2:
+                return 200, element, {}
+            if method == "GET" and parts[2:] == ["valuedomain"]:
+                _index = int(element["valueDomainUrn"].split(":")[-2])
+                return 200, get_value_domains()[_index], {}
+            if method == "PUT" and len(parts) == 2:
+                payload = json.loads(body)
+                with self._lock:
+                    payload["identification"]["urn"] = urn
+                    payload["identification"]["revision"] = \
+                        element["identification"]["revision"] + 1
+                    self.elements[urn] = payload
+                return 200, {}, {}
+
+        if method == "POST" and parts == ["element"]:
+            payload = json.loads(body)
+            with self._lock:
+                ns_id = payload["identification"].get(
+                    "namespaceUrn", "urn:{}:".format(self.ns_id)).split(":")[1]
+                urn = "urn:{}:dataelement:{}:1".format(ns_id, self.next_index)
+                self.next_index += 1
+                payload["identification"]["urn"] = urn
+                payload["identification"]["revision"] = 1
+                payload.setdefault("valueDomainUrn", "urn:{}:valuedomain:0:1".format(
+                    ns_id))
+                self.elements[urn] = payload
+            return 201, {}, {"Location": self.api_url + "element/" + urn}
+
+        return 404, {"error": "not found"}, {}
+
+    def get_handler(self):
+        hub = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            protocol_version = "HTTP/1.1"
+            # keep-alive without delayed acks
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def respond(self, method: str):
+                hub.count(method)
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+
+                if hub.latency:
+                    time.sleep(hub.latency)
+
+                if hub.fail():
+                    status, data, headers = 503, {"error": "unavailable"}, {}
+                else:
+                    status, data, headers = hub.handle(method, self.path, body)
+
+                content = json.dumps(data).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(content)))
+                for _key, _value in headers.items():
+                    self.send_header(_key, _value)
+                self.end_headers()
+                self.wfile.write(content)
+
+            def do_GET(self):
+                self.respond("GET")
+
+            def do_POST(self):
+                self.respond("POST")
+
+            def do_PUT(self):
+                self.respond("PUT")
+
+        return Handler
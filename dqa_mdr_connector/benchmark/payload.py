@@ -0,0 +1,134 @@
+#!/usr/bin/python
+
+# dqa-mdr-connector: Connecting the MIRACUM-MDR with the DQA-Tool
+# Copyright (C) 2022 Universitätsklinikum Erlangen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+__author__ = "Lorenz A. Kapsner, Moritz Stengel"
+__copyright__ = "Universitätsklinikum Erlangen"
+
+# micro-benchmark of building the data element payloads of UpdateMDR
+# (without any request), run from root directory:
+# python -m dqa_mdr_connector.benchmark.payload --rows 10000
+
+import argparse
+import json
+import logging
+import time
+
+import pandas as pd
+
+from dqa_mdr_connector.mdr_schema import mdr_apply_schema
+from dqa_mdr_connector.payload_builder import build_element, build_valuedomain
+from dqa_mdr_connector.slot_create import slot_create_dqa_value, slot_create_index
+
+# constraints of the csv file per variable_type
+__constraints = {
+    "string": {"regex": "^[A-Z][0-9]{2}$"},
+    "datetime": {"date": {"date": "YYYY-MM-DD", "time": "", "hourFormat": ""}},
+    "enumerated": {"value_set": "male, female, diverse, unknown"},
+    "float": {"range": {"min": 0.0, "max": 300.0, "unit": "kg"}},
+    "integer": {"range": {"min": 0, "max": 120, "unit": "a"}}
+}
+
+
+def get_payload_mdr(rows: int):
+    # mdr with 'rows' data elements (two systems each, all variable types)
+    variable_types = list(__constraints.keys())
+    records = []
+    for _i in range(rows):
+        _variable_type = variable_types[_i % len(variable_types)]
+        for _system_name, _system_type in [("i2b2", "postgres"), ("p21csv", "csv")]:
+            records.append({
+                "designation": "Dataelement {}".format(_i),
+                "definition": "Definition of dataelement {}".format(_i),
+                "variable_name": "variable_{}".format(_i),
+                "key": "Observation.element{}".format(_i),
+                "dqa_assessment": "1",
+                "variable_type": _variable_type,
+                "source_variable_name": "variable_{}".format(_i),
+                "source_table_name": "observation_fact",
+                "source_system_name": _system_name,
+                "source_system_type": _system_type,
+                "constraints": json.dumps(__constraints[_variable_type]),
+                "filter": "",
+                "data_map": "",
+                "plausibility_relation": "",
+                "restricting_date_var": "start_date",
+                "restricting_date_format": ""
+            })
+    return mdr_apply_schema(pd.DataFrame(records))
+
+
+def benchmark_payload(rows: int = 10000, repeat: int = 3):
+    mdr = get_payload_mdr(rows=rows)
+    mdr_index = slot_create_index(mdr=mdr)
+    main_system_rows = [_row for _i, _row in mdr[
+        mdr["source_system_name"] == "i2b2"].iterrows()]
+
+    # best of 'repeat' runs, building the payloads of new (POST) and of
+    # existing (PUT) data elements for every row
+    wall_time = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _row in main_system_rows:
+            dqa_value = slot_create_dqa_value(mdr=mdr, mdr_row=_row, mdr_index=mdr_index)
+            created = build_element(
+                ns_urn="urn:benchmark:namespace:1",
+                designation=_row["designation"],
+                definition=_row["definition"],
+                dqa_value=dqa_value
+            )
+            created["valueDomain"] = build_valuedomain(
+                variable_type=_row["variable_type"],
+                constraints=_row["constraints"]
+            )
+            updated = build_element(
+                ns_urn="urn:benchmark:namespace:1",
+                designation=_row["designation"],
+                definition=_row["definition"],
+                dqa_value=dqa_value,
+                slots=[{"name": "fhir-path", "value": _row["key"]}]
+            )
+            updated["valueDomainUrn"] = "urn:benchmark:valuedomain:1"
+        _wall_time = time.perf_counter() - start
+        wall_time = _wall_time if wall_time is None else min(wall_time, _wall_time)
+
+    return {
+        "benchmark": "Payload",
+        "rows": rows,
+        "wall_time": wall_time,
+        "throughput": rows / wall_time,
+        "wall_time_per_10k_rows": wall_time * 10000 / rows
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark building the data element payloads of UpdateMDR.")
+    parser.add_argument("--rows", type=int, default=10000,
+                        help="number of data elements (csv rows of the main system)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="number of runs (the fastest is reported)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    result = benchmark_payload(rows=args.rows, repeat=args.repeat)
+    print(pd.DataFrame([result]).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
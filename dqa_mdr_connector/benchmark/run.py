@@ -0,0 +1,195 @@
+#!/usr/bin/python
+
+# dqa-mdr-connector: Connecting the MIRACUM-MDR with the DQA-Tool
+# Copyright (C) 2022 Universitätsklinikum Erlangen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+__author__ = "Lorenz A. Kapsner, Moritz Stengel"
+__copyright__ = "Universitätsklinikum Erlangen"
+
+# run from root directory:
+# python -m dqa_mdr_connector.benchmark.run --sizes 100 1000 10000
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import tempfile
+import time
+
+import pandas as pd
+
+from dqa_mdr_connector.benchmark.mock_hub import MockHub
+from dqa_mdr_connector.get_mdr import GetMDR
+from dqa_mdr_connector.update_mdr import UpdateMDR
+
+
+def benchmark_get_mdr(hub: MockHub, work_dir: str, max_workers: int = 1):
+    output_filename = os.path.join(work_dir, "mdr_download.csv")
+
+    start = time.perf_counter()
+    gm = GetMDR(
+        output_folder=work_dir,
+        output_filename=output_filename,
+        api_url=hub.api_url,
+        bypass_auth=True,
+        namespace_designation=hub.namespace_designation,
+        max_workers=max_workers
+    )
+    gm()
+    wall_time = time.perf_counter() - start
+
+    return {
+        "benchmark": "GetMDR",
+        "elements": hub.size,
+        "wall_time": wall_time,
+        "throughput": hub.size / wall_time,
+        "rows": len(gm.database)
+    }
+
+
+def write_update_csv(hub: MockHub, csv_file: str, changed_share: float = 0.5,
+                     new_share: float = 0.1):
+    # mdr csv with one row per data element of the hub (for both systems);
+    # the first 'changed_share' elements are updated and 'new_share' *
+    # size elements are created by UpdateMDR
+    n_changed = int(hub.size * changed_share)
+    n_new = int(hub.size * new_share)
+
+    rows = []
+    for _i in range(hub.size + n_new):
+        _designation = "Dataelement {}".format(_i)
+        _table = "observation_fact_v2" if _i < n_changed else "observation_fact"
+        for _system_name, _system_type, _variable, _table_name, _date_var in [
+                ("i2b2", "postgres", "variable_{}", _table, "start_date"),
+                ("p21csv", "csv", "VARIABLE_{}", "FALL.CSV", "")]:
+            rows.append({
+                "designation": _designation,
+                "definition": "Definition of dataelement {}".format(_i),
+                "variable_name": "variable_{}".format(_i),
+                "key": "Observation.element{}".format(_i),
+                "dqa_assessment": 1 if _system_type == "postgres" else 0,
+                "variable_type": "string",
+                "source_variable_name": _variable.format(_i),
+                "source_table_name": _table_name,
+                "source_system_name": _system_name,
+                "source_system_type": _system_type,
+                "constraints": "",
+                "filter": "",
+                "data_map": "",
+                "plausibility_relation": "",
+                "restricting_date_var": _date_var,
+                "restricting_date_format": ""
+            })
+    pd.DataFrame(rows).to_csv(csv_file, sep=",", index=False)
+
+
+def benchmark_update_mdr(hub: MockHub, work_dir: str, max_workers: int = 1):
+    csv_file = os.path.join(work_dir, "mdr_upload.csv")
+    write_update_csv(hub=hub, csv_file=csv_file)
+
+    start = time.perf_counter()
+    um = UpdateMDR(
+        csv_file=csv_file,
+        separator=",",
+        api_url=hub.api_url,
+        bypass_auth=True,
+        namespace_designation=hub.namespace_designation,
+        max_workers=max_workers
+    )
+    results = um()
+    wall_time = time.perf_counter() - start
+
+    result = {
+        "benchmark": "UpdateMDR",
+        "elements": len(results),
+        "wall_time": wall_time,
+        "throughput": len(results) / wall_time
+    }
+    result.update(um.summary)
+    return result
+
+
+def run_benchmarks(sizes: list, latency: float = 0.0, error_rate: float = 0.0,
+                   max_workers: int = 1, benchmarks: list = None):
+    if benchmarks is None:
+        benchmarks = ["GetMDR", "UpdateMDR"]
+    functions = {
+        "GetMDR": benchmark_get_mdr,
+        "UpdateMDR": benchmark_update_mdr
+    }
+
+    results = []
+    for _size in sizes:
+        for _benchmark in benchmarks:
+            # a fresh hub for every run, as UpdateMDR changes its elements
+            with MockHub(size=_size, latency=latency, error_rate=error_rate) as hub, \
+                    tempfile.TemporaryDirectory() as work_dir:
+                result = functions[_benchmark](
+                    hub=hub, work_dir=work_dir, max_workers=max_workers)
+            result.update({
+                "latency": latency,
+                "error_rate": error_rate,
+                "max_workers": max_workers,
+                "requests": sum(hub.requests.values())
+            })
+            logging.warning(
+                "{benchmark} ({elements} elements): {wall_time:.2f} s, "
+                "{throughput:.1f} elements/s".format(**result))
+            results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark GetMDR and UpdateMDR against a local mock DataElementHub.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000],
+                        help="number of data elements in the namespace")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="delay of every response in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="share of requests failing with 503")
+    parser.add_argument("--max-workers", type=int, default=1)
+    parser.add_argument("--benchmarks", nargs="+", default=["GetMDR", "UpdateMDR"],
+                        choices=["GetMDR", "UpdateMDR"])
+    parser.add_argument("--output", default=None,
+                        help="append the results (json lines) to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    results = run_benchmarks(
+        sizes=args.sizes,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        max_workers=args.max_workers,
+        benchmarks=args.benchmarks
+    )
+
+    print(pd.DataFrame(results).to_string(index=False))
+
+    if args.output is not None:
+        # keep a history to track regressions and improvements
+        timestamp = datetime.datetime.now().isoformat(timespec="seconds")
+        with open(args.output, "a", encoding="utf-8") as f:
+            for _result in results:
+                _result.update({"timestamp": timestamp, "python": platform.python_version()})
+                f.write(json.dumps(_result) + "\n")
+
+
+if __name__ == "__main__":
+    main()
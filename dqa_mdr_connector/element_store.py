@@ -0,0 +1,84 @@
+#!/usr/bin/python
+
+# dqa-mdr-connector: Connecting the MIRACUM-MDR with the DQA-Tool
+# Copyright (C) 2022 Universitätsklinikum Erlangen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+__author__ = "Lorenz A. Kapsner, Moritz Stengel"
+__copyright__ = "Universitätsklinikum Erlangen"
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+
+
+class ElementStore():
+
+    def __init__(self, max_in_memory: int = 10000, spill_dir: str = None):
+        # keeps data element payloads during one run; the first
+        # 'max_in_memory' elements are kept in memory, all further elements
+        # are written to json files in 'spill_dir' (a temporary directory
+        # by default, which is removed by self.close())
+        self.max_in_memory = max_in_memory
+        self.spill_dir = spill_dir
+        self._remove_spill_dir = spill_dir is None
+
+        self._memory = {}
+        self._spilled = set()
+        self._lock = threading.Lock()
+
+    def get_path(self, urn: str):
+        return os.path.join(
+            self.spill_dir,
+            hashlib.sha256(urn.encode("utf-8")).hexdigest() + ".json"
+        )
+
+    def put(self, urn: str, element: dict):
+        with self._lock:
+            if urn in self._memory or len(self._memory) < self.max_in_memory:
+                self._memory[urn] = element
+                return
+
+            if self.spill_dir is None:
+                self.spill_dir = tempfile.mkdtemp(prefix="dqa_mdr_elements_")
+            os.makedirs(self.spill_dir, exist_ok=True)
+            self._spilled.add(urn)
+
+        with open(self.get_path(urn), "w", encoding="utf-8") as f:
+            json.dump(element, f)
+
+    def get(self, urn: str):
+        if urn in self._memory:
+            return self._memory[urn]
+        if urn not in self._spilled:
+            return None
+        with open(self.get_path(urn), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def __contains__(self, urn: str):
+        return urn in self._memory or urn in self._spilled
+
+    def __len__(self):
+        return len(self._memory) + len(self._spilled)
+
+    def close(self):
+        self._memory = {}
+        if self._remove_spill_dir and self.spill_dir is not None:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+            self.spill_dir = None
+        self._spilled = set()
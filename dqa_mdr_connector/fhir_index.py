@@ -0,0 +1,133 @@
+#!/usr/bin/python
+
+# dqa-mdr-connector: Connecting the MIRACUM-MDR with the DQA-Tool
+# Copyright (C) 2022 Universitätsklinikum Erlangen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+__author__ = "Lorenz A. Kapsner, Moritz Stengel"
+__copyright__ = "Universitätsklinikum Erlangen"
+
+import os
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+
+def get_fhir_path(element: dict):
+    # value of the "fhir-path" slot of a data element (None, if the
+    # element has no or several fhir-path slots)
+    fhir_path = [s for s in element["slots"] if s["name"] == "fhir-path"]
+    if len(fhir_path) == 1:
+        return fhir_path[0]["value"]
+    return None
+
+
+class FhirPathIndex():
+
+    def __init__(self, index_file: str, ns_urn: str):
+        # persisted mapping urn -> {"revision": ..., "fhir_path": ...} of
+        # all data elements of one namespace
+        self.index_file = os.path.abspath(index_file)
+        self.ns_urn = ns_urn
+        self.elements = {}
+
+        try:
+            with open(self.index_file, "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            logging.info("No fhir-path index found at '{}'.".format(self.index_file))
+            return
+
+        if index.get("ns_urn") == self.ns_urn:
+            self.elements = index["elements"]
+
+    def write(self):
+        tmp_file = self.index_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump({
+                "ns_urn": self.ns_urn,
+                "elements": self.elements
+            }, f)
+        os.replace(tmp_file, self.index_file)
+
+    def refresh(self, members: list, get_element, fhir_paths: set,
+                max_workers: int = 1):
+        # only fetch the data elements, which are new or changed (by urn and
+        # revision) since the index was built; removed elements are dropped.
+        # Returns the fetched elements with one of the wanted 'fhir_paths'.
+        refresh_urns = self.get_refresh_urns(members=members)
+
+        def _get_element(urn):
+            try:
+                return get_element(urn)
+            except Exception as e:
+                logging.error("Failed to fetch dataelement '{}': {}".format(urn, e))
+                return None
+
+        with ThreadPoolExecutor(max_workers=max(1, max_workers or 1)) as executor:
+            responses = dict(zip(refresh_urns, executor.map(_get_element, refresh_urns)))
+
+        return self.update(members=members, responses=responses, fhir_paths=fhir_paths)
+
+    def get_refresh_urns(self, members: list):
+        # urns of the new or changed data elements
+        refresh_urns = []
+        for _member in members:
+            _indexed = self.elements.get(_member["elementUrn"])
+            if _indexed is None or _indexed["revision"] != _member.get("revision"):
+                refresh_urns.append(_member["elementUrn"])
+
+        logging.info("Refreshing fhir-path index: {} of {} dataelements.".format(
+            len(refresh_urns), len(members)))
+        return refresh_urns
+
+    def update(self, members: list, responses: dict, fhir_paths: set):
+        # index the fetched data elements ('responses', urn -> element or
+        # None, if fetching it failed) and write the index; returns the
+        # fetched elements with one of the wanted 'fhir_paths'
+        elements = {}
+        fetched = {}
+        for _member in members:
+            _urn = _member["elementUrn"]
+            if _urn not in responses:
+                # unchanged
+                if _urn in self.elements:
+                    elements[_urn] = self.elements[_urn]
+                continue
+
+            _response = responses[_urn]
+            if _response is None:
+                # not indexed, will be retried
+                continue
+            _fhir_path = get_fhir_path(_response)
+            elements[_urn] = {
+                "revision": _member.get("revision"),
+                "fhir_path": _fhir_path
+            }
+            if _fhir_path in fhir_paths:
+                fetched[_urn] = _response
+
+        self.elements = elements
+        self.write()
+        return fetched
+
+    def filter_members(self, members: list, fhir_paths: set):
+        # members, which are not in the index (e.g. because fetching them
+        # failed) are kept
+        return [
+            _member for _member in members
+            if _member["elementUrn"] not in self.elements or
+            self.elements[_member["elementUrn"]]["fhir_path"] in fhir_paths
+        ]
@@ -20,14 +20,29 @@ __author__ = "Lorenz A. Kapsner, Moritz Stengel"
 __copyright__ = "Universitätsklinikum Erlangen"
 
 import os
+import re
+import copy
+import csv
+import contextlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 import pandas as pd
 import posixpath
 import json
 #from tabulate import tabulate
 import logging
+import threading
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
 
 from dqa_mdr_connector.api_connection import ApiConnector
-from dqa_mdr_connector.slot_split import slot_split
+from dqa_mdr_connector.journal import Journal
+from dqa_mdr_connector.json_codec import json_loads
+from dqa_mdr_connector.mdr_schema import get_mdr_columns, mdr_apply_schema, mdr_to_typed
+from dqa_mdr_connector.slot_split import slot_split_rows
 
 # api doc: https://rest.demo.dataelementhub.de/swagger-ui/index.html?configUrl=/v3/api-docs/swagger-config
 # dicovery doc: https://www.keycloak.org/docs/4.8/authorization_services/#_service_authorization_api
@@ -41,49 +56,312 @@ class GetMDR(ApiConnector):
         output_filename="dehub_mdr_clean.csv",
         de_fhir_paths: list = None,
         return_csv: bool = True,
+        max_workers: int = 1,
+        delta: bool = False,
+        state_file: str = None,
+        stream: bool = False,
+        journal_file: str = None,
+        fhir_index_file: str = None,
+        output_format: str = "csv",
+        split_namespaces: bool = False,
         **kwargs
         ):
 
+        # several namespaces can be downloaded at once by passing a list of
+        # designations as 'namespace_designation'
+        namespace_designations = kwargs.get("namespace_designation")
+        if not isinstance(namespace_designations, (list, tuple)):
+            namespace_designations = None
+        elif len(namespace_designations) == 0:
+            msg = "'namespace_designation' is an empty list: pass at least one designation"
+            logging.error(msg)
+            raise Exception(msg)
+        if namespace_designations is not None and stream and not split_namespaces:
+            msg = "stream with several namespaces requires split_namespaces=True"
+            logging.error(msg)
+            raise Exception(msg)
+
+        # "csv" (tab-separated), "parquet" or "arrow" (arrow ipc / feather);
+        # the columnar formats keep categorical and numeric columns.
+        # The arguments are checked before connecting to the api
+        if output_format not in ["csv", "parquet", "arrow"]:
+            msg = "output_format must be 'csv', 'parquet' or 'arrow'"
+            logging.error(msg)
+            raise Exception(msg)
+        if output_format != "csv" and pyarrow is None:
+            msg = "output_format '{}' requires the package 'pyarrow' ".format(output_format) + \
+                "(pip install dqa_mdr_connector[parquet])."
+            logging.error(msg)
+            raise Exception(msg)
+        if output_format != "csv" and stream:
+            msg = "stream is only supported with output_format 'csv'"
+            logging.error(msg)
+            raise Exception(msg)
+
+        # make sure the connection pool is large enough for all workers
+        # (of all namespaces)
+        kwargs.setdefault("pool_maxsize", max(10, (max_workers or 1) * (
+            1 if namespace_designations is None else len(namespace_designations))))
+
         super().__init__(**kwargs)
 
+        # one combined table (with a 'namespace' column) or one table / file
+        # per namespace ('output_filename' with the designation as suffix)
+        self.namespace_designations = None if namespace_designations is None else \
+            list(namespace_designations)
+        self.split_namespaces = split_namespaces
+        self.namespace_downloads = None
+
         self.de_fhir_paths = de_fhir_paths
+        # set for fast membership checks
+        self.de_fhir_paths_set = None if de_fhir_paths is None else set(de_fhir_paths)
+        # optional persisted fhir-path -> urn index, so that only the
+        # wanted data elements are fetched, if de_fhir_paths is set
+        self.fhir_index_file = fhir_index_file
+        self.prefetched = {}
         self.return_csv = return_csv
+        self.output_format = output_format
+        # number of data elements that are fetched from the api in parallel
+        self.max_workers = max_workers
 
         self.output_folder=os.path.abspath(output_folder)
         self.output_filename=os.path.abspath(output_filename)
 
+        # delta mode: only fetch data elements, which were added or changed
+        # since the last run (as recorded in the state file)
+        self.delta = delta
+        if state_file is None:
+            state_file = os.path.join(
+                self.output_folder,
+                self.output_filename
+            ) + ".state.json"
+        self.state_file = os.path.abspath(state_file)
+
+        # streaming mode: write the rows of each data element to the csv
+        # file as soon as they are ready instead of keeping them in memory
+        # (with delta, the rows of the previous run are still read into
+        # memory, as are the rows recorded in the journal of an interrupted
+        # run)
+        self.stream = stream
+
+        # optional journal for resuming an interrupted download
+        self.journal_file = journal_file
+        self.journal = None
+
+        # value domains of one run by valueDomainUrn (shared by all data
+        # elements with the same value domain)
+        self.value_domains = {}
+        self._value_domain_lock = threading.Lock()
+
         # initialize pandas
-        self.database = pd.DataFrame(
-            columns=['designation', 'definition', 'variable_name', 'key', 'dqa_assessment',
-                     'variable_type', 'source_variable_name', 'source_table_name',
-                     'source_system_name', 'source_system_type', 'constraints', 'filter',
-                     'data_map', 'plausibility_relation', 'restricting_date_var',
-                     'restricting_date_format']
-        )
+        self.database = mdr_apply_schema(pd.DataFrame(columns=get_mdr_columns()))
 
     def __call__(self):
-        self.query_info_from_api()
-        
-        if self.return_csv:
-            self.database.to_csv(
-                path_or_buf=os.path.join(
-                    self.output_folder,
-                    self.output_filename
-                ),
-                sep="\t",
-                index=False
-            )
+        try:
+            if self.namespace_designations is None:
+                self.download()
+            else:
+                self.download_namespaces()
+        finally:
+            self.write_metrics()
+
+        return self.finish()
+
+    def download(self, check_namespace: bool = True):
+        if self.return_csv and self.stream:
+            with self.csv_row_writer() as row_writer:
+                self.query_info_from_api(
+                    row_writer=row_writer, check_namespace=check_namespace)
         else:
+            self.query_info_from_api(check_namespace=check_namespace)
+
+    def download_namespaces(self):
+        # one namespace listing for all namespaces, which are then crawled
+        # concurrently
+        response = self.query_api(
+            url=self.base_url + "namespaces/",
+            header=self.header
+        )
+        self.select_namespace_downloads(response=response)
+
+        with ThreadPoolExecutor(max_workers=len(self.namespace_downloads)) as executor:
+            list(executor.map(
+                lambda _gm: _gm.download(check_namespace=False),
+                self.namespace_downloads.values()
+            ))
+
+        self.combine_namespace_downloads()
+
+    def select_namespace_downloads(self, response: dict):
+        namespace_lookup = self.get_namespace_lookup(response=response)
+
+        missing = [_designation for _designation in self.namespace_designations
+                   if _designation not in namespace_lookup]
+        if len(missing) > 0:
+            msg = "No namespaces found at '{}' for namespace_designation {}".format(
+                self.base_url,
+                missing
+            )
+            logging.error(msg)
+            raise Exception(msg)
+
+        self.namespace_downloads = {
+            _designation: self.for_namespace(
+                designation=_designation,
+                namespace=namespace_lookup[_designation]
+            ) for _designation in self.namespace_designations
+        }
+
+    def for_namespace(self, designation: str, namespace: dict):
+        # download of one namespace, sharing the connection (session, tokens,
+        # metrics) with this one; all files get the designation as suffix
+        gm = copy.copy(self)
+        gm.namespace_designation = designation
+        gm.namespace_designations = None
+        gm.namespace_downloads = None
+        gm.ns_id = namespace["id"]
+        gm.ns_urn = namespace["urn"]
+
+        gm.database = mdr_apply_schema(pd.DataFrame(columns=get_mdr_columns()))
+        gm.prefetched = {}
+        gm.value_domains = {}
+        gm._value_domain_lock = threading.Lock()
+        gm.journal = None
+
+        if self.split_namespaces:
+            gm.output_filename = self.get_namespace_file(
+                file_name=self.output_filename, designation=designation)
+        gm.state_file = self.get_namespace_file(
+            file_name=self.state_file, designation=designation)
+        if self.journal_file is not None:
+            gm.journal_file = self.get_namespace_file(
+                file_name=self.journal_file, designation=designation)
+        if self.fhir_index_file is not None:
+            gm.fhir_index_file = self.get_namespace_file(
+                file_name=self.fhir_index_file, designation=designation)
+        return gm
+
+    @staticmethod
+    def get_namespace_file(file_name: str, designation: str):
+        # e.g. "mdr.csv" -> "mdr_test_mdr.csv"
+        root, ext = os.path.splitext(file_name)
+        return "{}_{}{}".format(root, re.sub(r"[^\w.-]+", "_", designation), ext)
+
+    def combine_namespace_downloads(self):
+        if self.split_namespaces:
+            return
+
+        databases = []
+        for _designation, _gm in self.namespace_downloads.items():
+            _database = _gm.database.copy()
+            _database.insert(0, "namespace", _designation)
+            databases.append(_database)
+
+        self.database = mdr_apply_schema(pd.concat(databases, ignore_index=True))
+        self.database["namespace"] = self.database["namespace"].astype("category")
+
+    def finish(self):
+        # write the output file(s) or return the table(s)
+        if self.namespace_designations is not None and self.split_namespaces:
+            if not self.return_csv:
+                return {_designation: _gm.database
+                        for _designation, _gm in self.namespace_downloads.items()}
+            if not self.stream:
+                for _gm in self.namespace_downloads.values():
+                    _gm.write_output()
+            return
+
+        if not self.return_csv:
             return self.database
+        if not self.stream:
+            self.write_output()
+
+    def write_output(self):
+        if self.output_format == "parquet":
+            self.write_parquet()
+        elif self.output_format == "arrow":
+            self.write_arrow()
+        else:
+            self.write_csv()
+
+    def write_parquet(self):
+        mdr_to_typed(self.database).to_parquet(
+            path=os.path.join(self.output_folder, self.output_filename),
+            index=False
+        )
+
+    def write_arrow(self):
+        mdr_to_typed(self.database).to_feather(
+            path=os.path.join(self.output_folder, self.output_filename)
+        )
+
+    def write_csv(self):
+        self.database.to_csv(
+            path_or_buf=os.path.join(
+                self.output_folder,
+                self.output_filename
+            ),
+            sep="\t",
+            index=False
+        )
 
-    def query_info_from_api(self):
+    @contextlib.contextmanager
+    def csv_row_writer(self):
+        with open(
+            os.path.join(self.output_folder, self.output_filename),
+            "w",
+            newline="",
+            encoding="utf-8"
+        ) as f:
+            # same format as self.database.to_csv(sep="\t", index=False)
+            writer = csv.writer(f, delimiter="\t", lineterminator=os.linesep)
+            writer.writerow(self.database.columns)
+
+            def _write_rows(element_rows):
+                writer.writerows(
+                    [[_row.get(_col, "") for _col in self.database.columns]
+                     for _row in element_rows]
+                )
+                f.flush()
+
+            yield _write_rows
+
+    def query_info_from_api(self, row_writer=None, check_namespace: bool = True):
         ######################
         # query info from api
         ######################
 
         # if namespace exists, self.ns_id will be set
-        self.check_if_namespace_exists()
+        # (already done for the namespaces of a multi-namespace download)
+        if check_namespace:
+            self.check_if_namespace_exists()
+        self.check_namespace_found()
+
+        namespace_dataelements = self.get_namespace_members(ns_id=self.ns_id)
+        self.value_domains = {}
+
+        if self.de_fhir_paths is not None and self.fhir_index_file is not None:
+            namespace_dataelements, self.prefetched = self.filter_members_by_fhir_path(
+                members=namespace_dataelements,
+                de_fhir_paths=self.de_fhir_paths,
+                fhir_index_file=self.fhir_index_file,
+                max_workers=self.max_workers
+            )
 
+        previous_state, fetch_urns = self.select_fetch_urns(
+            namespace_dataelements=namespace_dataelements)
+
+        # now iterate over dataelements, extract information and put into pandas
+        # (elements are fetched concurrently, if max_workers > 1)
+        self.collect_rows(
+            namespace_dataelements=namespace_dataelements,
+            previous_state=previous_state,
+            fetch_urns=fetch_urns,
+            fetched_rows=self.iter_elements(urns=fetch_urns),
+            row_writer=row_writer
+        )
+
+    def check_namespace_found(self):
         if self.ns_id is None:
             msg = "No or multiple namespaces found at '{}' for namespace_designation '{}'".format(
                 self.base_url,
@@ -92,130 +370,321 @@ class GetMDR(ApiConnector):
             logging.error(msg)
             raise Exception(msg)
 
-        namespace_dataelement_urns = self.get_namespace_urns(ns_id=self.ns_id)
-
-        # now iterate over dataelements, extract information and put into pandas
-        for _dataelement_urn in namespace_dataelement_urns:
-            # get data element metadata
-            response, ns_dataelement_url = self.get_element_by_urn(
-                urn=_dataelement_urn)
-            
-            if not self.de_fhir_paths is None:
-                fhir_path = [s for s in response["slots"] if s["name"] == "fhir-path"]
-                if len(fhir_path) == 1:
-                    if not fhir_path[0]["value"] in self.de_fhir_paths:
-                        # continue loop, if this dataelement is not wanted
-                        continue
-                else:
-                    continue
-
-            dict_to_pandas = {
-                "designation": response["definitions"][0]["designation"],
-                "definition": response["definitions"][0]["definition"]
-            }
+    def select_fetch_urns(self, namespace_dataelements: list):
+        # in delta mode, reuse the rows of all data elements with unchanged
+        # urn and revision from the previous run
+        previous_state = self.read_state() if self.delta else {}
 
-            # if fhir path not none and code arrived here (i.e. the de 
-            # is in self.de_fhir_path) also add the fhir-path as key
-            if not self.de_fhir_paths is None and len(fhir_path) == 1:
-                dict_to_pandas["key"] = fhir_path[0]["value"]
-                dict_to_pandas["variable_name"] = dict_to_pandas["key"]
+        fetch_urns = []
+        for _member in namespace_dataelements:
+            _previous = previous_state.get(_member["elementUrn"])
+            if _previous is None or _previous["revision"] != _member.get("revision"):
+                fetch_urns.append(_member["elementUrn"])
 
-            # dataelement valuedomain url
-            ns_dataelement_valuedom_url = posixpath.join(
-                ns_dataelement_url, "valuedomain")
+        logging.info("Fetching {} of {} dataelements.".format(
+            len(fetch_urns), len(namespace_dataelements)))
 
-            # get data element metadata
-            response_valuedom = self.query_api(
-                url=ns_dataelement_valuedom_url,
-                header=self.header
+        if self.journal_file is not None:
+            self.journal = Journal(
+                journal_file=self.journal_file,
+                identity=self.get_journal_identity()
             )
 
-            if response_valuedom["type"] == "STRING":
-                dict_to_pandas["variable_type"] = response_valuedom["type"].lower()
-
-                # dict_to_pandas["constraints"] = json.dumps(
-                #     {"regex": response["text"]["regEx"]
-                #      #  "useRegex": response["text"]["useRegEx"],
-                #      #  "useMaximumLength": response["text"]["useMaximumLength"],
-                #      #  "maximumLength": response["text"]["maximumLength"]
-                #      }
-                # )
-
-            elif response_valuedom["type"] == "NUMERIC":
-                dict_to_pandas["variable_type"] = response_valuedom["numeric"]["type"].lower()
-
-                # dict_to_pandas["constraints"] = json.dumps(
-                #     {"range": {"min": response["numeric"]["minimum"],
-                #                "max": response["numeric"]["maximum"],
-                #                "unit": response["numeric"]["unitOfMeasure"],
-                #                }
-                #      }
-                # )
-
-            elif "DATE" in response_valuedom["type"]:
-                dict_to_pandas["variable_type"] = "datetime"
+        return previous_state, fetch_urns
+
+    def get_journal_identity(self):
+        # the journal is only resumed for the same namespace and
+        # de_fhir_paths (like the delta state)
+        return {
+            "run": "GetMDR",
+            "api_url": self.base_url,
+            "ns_urn": self.ns_urn,
+            "de_fhir_paths": self.de_fhir_paths
+        }
+
+    def collect_rows(self, namespace_dataelements: list, previous_state: dict,
+                     fetch_urns: list, fetched_rows, row_writer=None):
+        # 'fetched_rows' yields the rows of each of the 'fetch_urns' in order
+        fetched_rows = iter(fetched_rows)
+        fetch_urns = set(fetch_urns)
+
+        # keep the order of the namespace members; removed data elements
+        # are not part of the listing anymore and are dropped
+        rows = []
+        failed = 0
+        with contextlib.ExitStack() as stack:
+            state_writer = stack.enter_context(self.state_writer()) if self.delta else None
+
+            for _member in namespace_dataelements:
+                _urn = _member["elementUrn"]
+                if _urn in fetch_urns:
+                    element_rows = next(fetched_rows)
+                else:
+                    element_rows = previous_state[_urn]["rows"]
 
-                # dict_to_pandas["constraints"] = json.dumps(
-                #     {"date": {"date": response["datetime"]["date"],
-                #               "time": response["datetime"]["time"],
-                #               "hourFormat": response["datetime"]["hourFormat"]}}
-                # )
+                if element_rows is None:
+                    # download of this element failed
+                    failed += 1
+                    continue
 
-            elif response_valuedom["type"] == "BOOLEAN":
-                dict_to_pandas["variable_type"] = response_valuedom["type"].lower()
+                if state_writer is not None:
+                    state_writer(_urn, _member.get("revision"), element_rows)
 
-            elif response_valuedom["type"] == "ENUMERATED":
-                dict_to_pandas["variable_type"] = response_valuedom["type"].lower()
+                if row_writer is None:
+                    rows.extend(element_rows)
+                else:
+                    row_writer(element_rows)
+
+        if self.journal is not None:
+            # keep the journal, if some elements need to be fetched again
+            self.journal.close(remove=failed == 0)
+            self.journal = None
+
+        self.database = mdr_apply_schema(
+            pd.DataFrame(data=rows, columns=get_mdr_columns()))
+
+    def read_state(self):
+        # rows and revisions of the data elements from the previous run;
+        # the state is only valid for the same namespace and de_fhir_paths
+        try:
+            with open(self.state_file, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            logging.info("No previous state found at '{}'.".format(self.state_file))
+            return {}
+
+        if state.get("ns_urn") != self.ns_urn or \
+                state.get("de_fhir_paths") != self.de_fhir_paths:
+            logging.info("Previous state does not match, doing a full download.")
+            return {}
+
+        return state["elements"]
+
+    @contextlib.contextmanager
+    def state_writer(self):
+        # the state is written element by element (and not collected in
+        # memory); the state file is only replaced, if all elements were
+        # written
+        tmp_file = self.state_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            f.write('{{"ns_urn": {}, "de_fhir_paths": {}, "elements": {{'.format(
+                json.dumps(self.ns_urn), json.dumps(self.de_fhir_paths)))
+            separator = [""]
+
+            def _write_element(urn, revision, rows):
+                f.write("{}{}: {}".format(separator[0], json.dumps(urn), json.dumps({
+                    "revision": revision,
+                    "rows": rows
+                })))
+                separator[0] = ", "
+
+            yield _write_element
+            f.write("}}")
+        os.replace(tmp_file, self.state_file)
+
+    def fetch_elements(self, urns: list):
+        # returns a list with the rows of each urn, keeping the order of 'urns'
+        return list(self.iter_elements(urns=urns))
+
+    def iter_elements(self, urns: list):
+        # yields the rows of each urn, keeping the order of 'urns';
+        # at most 4 * max_workers elements are fetched ahead
+        if self.max_workers is None or self.max_workers <= 1:
+            for _urn in urns:
+                yield self.get_element_rows(urn=_urn)
+            return
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = deque()
+            for _urn in urns:
+                pending.append(executor.submit(self.get_element_rows, urn=_urn))
+                if len(pending) >= 4 * self.max_workers:
+                    yield pending.popleft().result()
+            while len(pending) > 0:
+                yield pending.popleft().result()
+
+    def get_element_rows(self, urn: str):
+        # returns the rows of one data element (an empty list, if the data
+        # element is not wanted) or None, if the download failed
+        # (one failing element must not abort the others)
+        if self.journal is not None and urn in self.journal.fetched:
+            return self.journal.fetched[urn]
+
+        try:
+            element_rows = self.fetched_to_rows(fetched=self.fetch_element(urn=urn))
+        except Exception as e:
+            logging.error("Failed to fetch dataelement '{}': {}".format(urn, e))
+            return None
+
+        if self.journal is not None:
+            self.journal.record_fetched(urn=urn, data=element_rows)
+        return element_rows
+
+    def fetched_to_rows(self, fetched):
+        if fetched is None:
+            return []
+        return self.element_to_rows(*fetched)
+
+    def fetch_element(self, urn: str):
+        # get data element and its valuedomain from the api;
+        # returns None, if the data element is not wanted
+        ns_dataelement_url = self.get_element_url(urn=urn)
+        # element was already fetched while refreshing the fhir-path index
+        response = self.prefetched.pop(urn, None)
+        if response is None:
+            response, ns_dataelement_url = self.get_element_by_urn(urn=urn)
+
+        fhir_path = self.get_fhir_path_slots(response=response)
+        if not self.is_wanted(fhir_path=fhir_path):
+            # skip, if this dataelement is not wanted
+            return None
+
+        response_valuedom = self.get_value_domain(
+            value_domain_urn=response.get("valueDomainUrn"),
+            ns_dataelement_url=ns_dataelement_url
+        )
 
-                # permitted_val_response = response["permittedValues"]
+        return response, fhir_path, response_valuedom
 
-                # # default empty list
-                # value_list = []
+    def get_value_domain(self, value_domain_urn: str, ns_dataelement_url: str):
+        # every value domain is only requested once per run; threads asking
+        # for a value domain, which is currently requested, wait for it
+        ns_dataelement_valuedom_url = posixpath.join(
+            ns_dataelement_url, "valuedomain")
 
-                # # fill value list
-                # for val in permitted_val_response:
-                #     value_list = value_list + [val["value"]]
+        if value_domain_urn is None:
+            return self.query_api(
+                url=ns_dataelement_valuedom_url,
+                header=self.header
+            )
 
-                # dict_to_pandas["constraints"] = json.dumps(
-                #     {"value_set": ", ".join(value_list)})
+        with self._value_domain_lock:
+            future = self.value_domains.get(value_domain_urn)
+            requesting = future is None
+            if requesting:
+                future = Future()
+                self.value_domains[value_domain_urn] = future
+
+        if requesting:
+            try:
+                future.set_result(self.query_api(
+                    url=ns_dataelement_valuedom_url,
+                    header=self.header
+                ))
+            except Exception as e:
+                # not memoized, the next data element tries again
+                with self._value_domain_lock:
+                    del self.value_domains[value_domain_urn]
+                future.set_exception(e)
+
+        return future.result()
+
+    @staticmethod
+    def get_fhir_path_slots(response: dict):
+        return [s for s in response["slots"] if s["name"] == "fhir-path"]
+
+    def is_wanted(self, fhir_path: list):
+        # all data elements are wanted, if de_fhir_paths is not set
+        if self.de_fhir_paths is None:
+            return True
+        return len(fhir_path) == 1 and fhir_path[0]["value"] in self.de_fhir_paths_set
+
+    def element_to_rows(self, response: dict, fhir_path: list, response_valuedom: dict):
+        dict_to_pandas = {
+            "designation": response["definitions"][0]["designation"],
+            "definition": response["definitions"][0]["definition"]
+        }
+
+        # if fhir path not none and code arrived here (i.e. the de 
+        # is in self.de_fhir_path) also add the fhir-path as key
+        if not self.de_fhir_paths is None and len(fhir_path) == 1:
+            dict_to_pandas["key"] = fhir_path[0]["value"]
+            dict_to_pandas["variable_name"] = dict_to_pandas["key"]
+
+        if response_valuedom["type"] == "STRING":
+            dict_to_pandas["variable_type"] = response_valuedom["type"].lower()
+
+            # dict_to_pandas["constraints"] = json.dumps(
+            #     {"regex": response["text"]["regEx"]
+            #      #  "useRegex": response["text"]["useRegEx"],
+            #      #  "useMaximumLength": response["text"]["useMaximumLength"],
+            #      #  "maximumLength": response["text"]["maximumLength"]
+            #      }
+            # )
+
+        elif response_valuedom["type"] == "NUMERIC":
+            dict_to_pandas["variable_type"] = response_valuedom["numeric"]["type"].lower()
+
+            # dict_to_pandas["constraints"] = json.dumps(
+            #     {"range": {"min": response["numeric"]["minimum"],
+            #                "max": response["numeric"]["maximum"],
+            #                "unit": response["numeric"]["unitOfMeasure"],
+            #                }
+            #      }
+            # )
+
+        elif "DATE" in response_valuedom["type"]:
+            dict_to_pandas["variable_type"] = "datetime"
+
+            # dict_to_pandas["constraints"] = json.dumps(
+            #     {"date": {"date": response["datetime"]["date"],
+            #               "time": response["datetime"]["time"],
+            #               "hourFormat": response["datetime"]["hourFormat"]}}
+            # )
+
+        elif response_valuedom["type"] == "BOOLEAN":
+            dict_to_pandas["variable_type"] = response_valuedom["type"].lower()
+
+        elif response_valuedom["type"] == "ENUMERATED":
+            dict_to_pandas["variable_type"] = response_valuedom["type"].lower()
+
+            # permitted_val_response = response["permittedValues"]
+
+            # # default empty list
+            # value_list = []
+
+            # # fill value list
+            # for val in permitted_val_response:
+            #     value_list = value_list + [val["value"]]
+
+            # dict_to_pandas["constraints"] = json.dumps(
+            #     {"value_set": ", ".join(value_list)})
+
+        # one data element can expand to several rows (for different
+        # system types and system names); rows are collected as plain
+        # dicts and the data frame is built only once at the end
+        return self.expand_element_rows(
+            dict_to_pandas=dict_to_pandas,
+            slots=response["slots"]
+        )
 
-            mdr_temp = pd.DataFrame(
-                data=dict_to_pandas,
-                dtype=str,
-                index=[0]
+    @staticmethod
+    def expand_element_rows(dict_to_pandas: dict, slots: list):
+        # until now, dict_to_pandas is one row,
+        # however, when expanding slot, we can get several rows (for different
+        # system types and system names) for one data element.
+        # Hence, we need to combine dict_to_pandas with each row
+        # from the expanded slot
+        dqa_slot = None
+        for _element in slots:
+            if _element["name"] == "dqa":
+                dqa_slot = _element["value"]
+                break
+
+        if dqa_slot is None:
+            return [dict_to_pandas]
+
+        try:
+            slot_rows = slot_split_rows(
+                json_slot=json_loads(dqa_slot),
+                designation=dict_to_pandas["designation"],
+                definition=dict_to_pandas["definition"]
             )
+        except Exception as e:
+            logging.error(e)
+            return [dict_to_pandas]
 
-            if len(response["slots"]) > 0:
-                # until now, dict_to_pandas is one row,
-                # however, when expanding slot, we can get several rows (for different
-                # system types and system names) for one data element.
-                # Hence, we need to transfer dict_to_pandas to a data frame and join data frame
-                # from expanded slot
-
-                for _element in response["slots"]:
-                    if _element["name"] == "dqa":
-                        dqa_slot = _element["value"]
-                        break
-
-                try:
-                    pandas_from_slot = slot_split(
-                        json_slot=json.loads(dqa_slot),
-                        designation=dict_to_pandas["designation"],
-                        definition=dict_to_pandas["definition"]
-                    )
-                    mdr_temp = mdr_temp.astype(str).merge(
-                        pandas_from_slot.astype(str),
-                        on=["designation", "definition"],
-                        how="outer"
-                    )
-                except Exception as e:
-                    logging.error(e)
-
-            self.database = pd.concat(
-                [self.database, mdr_temp],
-                ignore_index=True,
-                axis=0,
-                join="outer"
-            )
+        if len(slot_rows) == 0:
+            return [dict_to_pandas]
 
-            
+        return [{**dict_to_pandas, **_slot_row} for _slot_row in slot_rows]
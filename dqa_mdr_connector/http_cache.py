@@ -0,0 +1,161 @@
+#!/usr/bin/python
+
+# dqa-mdr-connector: Connecting the MIRACUM-MDR with the DQA-Tool
+# Copyright (C) 2022 Universitätsklinikum Erlangen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+__author__ = "Lorenz A. Kapsner, Moritz Stengel"
+__copyright__ = "Universitätsklinikum Erlangen"
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+
+
+class HttpCache():
+
+    def __init__(
+        self,
+        cache_dir: str,
+        ttl: float = 3600,
+        max_size: int = 512 * 1024 * 1024
+    ):
+        # on-disk cache for api responses (one json file per url and auth
+        # scope); entries older than 'ttl' seconds are revalidated, the
+        # least recently used entries are removed, if the cache grows
+        # larger than 'max_size' bytes
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.ttl = ttl
+        self.max_size = max_size
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "revalidated": 0
+        }
+
+        # current size of the cache in bytes
+        self._size = sum(_size for _, _size, _ in self.list_entries())
+
+    @staticmethod
+    def get_key(url: str, scope: str):
+        return hashlib.sha256(
+            "{}\n{}".format(scope, url).encode("utf-8")).hexdigest()
+
+    def get_path(self, key: str):
+        return os.path.join(self.cache_dir, key + ".json")
+
+    def get(self, key: str):
+        path = self.get_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        # mark entry as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry
+
+    def is_fresh(self, entry: dict):
+        return time.time() - entry["stored"] < self.ttl
+
+    def set(self, key: str, url: str, body: str, etag: str = None,
+            last_modified: str = None):
+        entry = {
+            "url": url,
+            "stored": time.time(),
+            "etag": etag,
+            "last_modified": last_modified,
+            "body": body
+        }
+        path = self.get_path(key)
+        tmp_path = "{}.{}.tmp".format(path, threading.get_ident())
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+
+        with self._lock:
+            try:
+                self._size -= os.path.getsize(path)
+            except OSError:
+                pass
+            os.replace(tmp_path, path)
+            self._size += os.path.getsize(path)
+
+            if self._size > self.max_size:
+                self.evict()
+
+    def delete(self, key: str):
+        path = self.get_path(key)
+        with self._lock:
+            try:
+                _size = os.path.getsize(path)
+                os.remove(path)
+            except OSError:
+                return
+            self._size -= _size
+
+    def touch(self, key: str):
+        # revalidated entries are fresh again
+        entry = self.get(key)
+        if entry is not None:
+            self.set(
+                key=key,
+                url=entry["url"],
+                body=entry["body"],
+                etag=entry["etag"],
+                last_modified=entry["last_modified"]
+            )
+
+    def count(self, stat: str):
+        with self._lock:
+            self.stats[stat] += 1
+
+    def list_entries(self):
+        entries = []
+        for _file in os.listdir(self.cache_dir):
+            if not _file.endswith(".json"):
+                continue
+            try:
+                _stat = os.stat(os.path.join(self.cache_dir, _file))
+            except OSError:
+                continue
+            entries.append((_stat.st_mtime, _stat.st_size, _file))
+        return entries
+
+    def evict(self):
+        # remove least recently used entries first, until 90 % of
+        # 'max_size' are reached (must be called with self._lock held)
+        entries = self.list_entries()
+        self._size = sum(_size for _, _size, _ in entries)
+
+        for _mtime, _size, _file in sorted(entries):
+            if self._size <= 0.9 * self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, _file))
+            except OSError:
+                continue
+            self._size -= _size
+            logging.debug("Removed cache entry '{}'".format(_file))
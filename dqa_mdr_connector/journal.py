@@ -0,0 +1,116 @@
+#!/usr/bin/python
+
+# dqa-mdr-connector: Connecting the MIRACUM-MDR with the DQA-Tool
+# Copyright (C) 2022 Universitätsklinikum Erlangen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+__author__ = "Lorenz A. Kapsner, Moritz Stengel"
+__copyright__ = "Universitätsklinikum Erlangen"
+
+import os
+import json
+import logging
+import threading
+
+
+class Journal():
+
+    def __init__(self, journal_file: str, identity: dict = None):
+        # append-only journal (one json object per line) of the finished
+        # requests of a run; rerunning with the same journal file skips
+        # everything that is already recorded. The first line records the
+        # 'identity' of the run (e.g. namespace and csv file), a journal of
+        # another run is not resumed but started anew
+        self.journal_file = os.path.abspath(journal_file)
+        # as read back from json
+        self.identity = json.loads(json.dumps(identity))
+
+        # urn -> fetched data (of the interrupted run; the data recorded in
+        # this run is only written to the file, so that memory use does
+        # not grow with the run)
+        self.fetched = {}
+        # csv row -> {"action": ..., "urn": ...}
+        self.uploaded = {}
+
+        self._lock = threading.Lock()
+        complete = self.read()
+
+        if complete is None:
+            self._file = open(self.journal_file, "w", encoding="utf-8")
+            self.write({"type": "header", "identity": self.identity})
+        else:
+            self._file = open(self.journal_file, "a", encoding="utf-8")
+            if not complete:
+                # terminate the last line of an interrupted run
+                self._file.write("\n")
+
+    def read(self):
+        # returns False, if the last line is incomplete, and None, if there
+        # is no journal of this run
+        try:
+            f = open(self.journal_file, "r", encoding="utf-8")
+        except OSError:
+            return None
+
+        with f:
+            try:
+                header = json.loads(f.readline())
+            except ValueError:
+                header = None
+            if not isinstance(header, dict) or header.get("type") != "header" or \
+                    header.get("identity") != self.identity:
+                logging.warning(
+                    "Journal '{}' belongs to another run, starting a new journal.".format(
+                        self.journal_file))
+                return None
+
+            _line = "\n"
+            for _line in f:
+                try:
+                    entry = json.loads(_line)
+                except ValueError:
+                    # last line of an interrupted run
+                    continue
+                if entry["type"] == "fetched":
+                    self.fetched[entry["urn"]] = entry["data"]
+                elif entry["type"] == "uploaded":
+                    self.uploaded[entry["row"]] = {
+                        "action": entry["action"],
+                        "urn": entry["urn"]
+                    }
+
+        logging.info("Resuming from journal '{}': {} fetched, {} uploaded.".format(
+            self.journal_file, len(self.fetched), len(self.uploaded)))
+
+        return _line.endswith("\n")
+
+    def write(self, entry: dict):
+        with self._lock:
+            self._file.write(json.dumps(entry) + "\n")
+            self._file.flush()
+
+    def record_fetched(self, urn: str, data):
+        self.write({"type": "fetched", "urn": urn, "data": data})
+
+    def record_uploaded(self, row: str, action: str, urn: str):
+        self.uploaded[row] = {"action": action, "urn": urn}
+        self.write({"type": "uploaded", "row": row, "action": action, "urn": urn})
+
+    def close(self, remove: bool = False):
+        # remove the journal, when the run has finished completely
+        if not self._file.closed:
+            self._file.close()
+        if remove:
+            os.remove(self.journal_file)
@@ -0,0 +1,69 @@
+#!/usr/bin/python
+
+# dqa-mdr-connector: Connecting the MIRACUM-MDR with the DQA-Tool
+# Copyright (C) 2022 Universitätsklinikum Erlangen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+__author__ = "Lorenz A. Kapsner, Moritz Stengel"
+__copyright__ = "Universitätsklinikum Erlangen"
+
+import json
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# json of api responses, request bodies and dqa slots: orjson is used, if
+# installed (pip install dqa_mdr_connector[fast-json]), the standard
+# library otherwise; DQA_MDR_JSON_BACKEND=json always uses the standard
+# library
+if os.environ.get("DQA_MDR_JSON_BACKEND", "orjson") == "json":
+    orjson = None
+
+
+def get_json_backend():
+    return "json" if orjson is None else "orjson"
+
+
+def json_loads(data):
+    # parse a str or the raw bytes of a response (no decoding needed)
+    if orjson is None:
+        return json.loads(data)
+    try:
+        return orjson.loads(data)
+    except (TypeError, ValueError):
+        # values orjson does not support (NaN, integers > 64 bit, ...)
+        # and errors are left to the standard library, so that results and
+        # exceptions do not depend on the backend
+        return json.loads(data)
+
+
+def json_dumps(obj):
+    # json text, which is stored in the mdr (e.g. the value of the dqa
+    # slot): always formatted as by the standard library, so that the
+    # stored values do not depend on the backend
+    return json.dumps(obj)
+
+
+def json_body(obj):
+    # utf-8 encoded request body
+    if orjson is None:
+        return json.dumps(obj).encode("utf-8")
+    try:
+        return orjson.dumps(obj)
+    except TypeError:
+        return json.dumps(obj).encode("utf-8")
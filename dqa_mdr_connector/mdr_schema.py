@@ -0,0 +1,178 @@
+#!/usr/bin/python
+
+# dqa-mdr-connector: Connecting the MIRACUM-MDR with the DQA-Tool
+# Copyright (C) 2022 Universitätsklinikum Erlangen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+__author__ = "Lorenz A. Kapsner, Moritz Stengel"
+__copyright__ = "Universitätsklinikum Erlangen"
+
+import logging
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from dqa_mdr_connector.json_codec import json_loads
+
+
+# columns of the mdr table and their dtypes: repeated values (system names
+# and types, table names, ...) are stored as categorical, all other texts
+# as nullable strings (missing values are <NA>, never "nan" / "None")
+__mdr_schema = {
+    "designation": "string",
+    "definition": "string",
+    "variable_name": "string",
+    "key": "string",
+    "dqa_assessment": "string",
+    "variable_type": "category",
+    "source_variable_name": "string",
+    "source_table_name": "category",
+    "source_system_name": "category",
+    "source_system_type": "category",
+    "constraints": "string",
+    "filter": "string",
+    "data_map": "string",
+    "plausibility_relation": "string",
+    "restricting_date_var": "category",
+    "restricting_date_format": "category"
+}
+
+# columns, which are only converted for the typed output formats (parquet /
+# arrow): the table keeps their text, so that the csv and stream outputs
+# are the same
+__mdr_typed = {
+    "dqa_assessment": "Int8"
+}
+
+
+def get_mdr_columns():
+    return list(__mdr_schema.keys())
+
+
+def mdr_apply_schema(mdr: pd.DataFrame):
+    # returns the mdr with the dtypes of the schema (missing columns are
+    # added, further columns are kept as they are)
+    mdr = mdr.reset_index(drop=True)
+    for _col, _dtype in __mdr_schema.items():
+        if _col not in mdr.columns:
+            mdr[_col] = pd.Series(pd.NA, index=mdr.index, dtype=_dtype)
+        elif _dtype == "category":
+            mdr[_col] = mdr[_col].astype("string").astype(_dtype)
+        else:
+            mdr[_col] = mdr[_col].astype(_dtype)
+    return mdr
+
+
+def mdr_to_typed(mdr: pd.DataFrame):
+    # copy of the mdr with the typed columns converted (for parquet / arrow);
+    # values, which cannot be converted, are an error instead of being lost.
+    # Empty values (also "None" and "nan", as written by slot_split) are
+    # missing
+    mdr = mdr.copy()
+    for _col, _dtype in __mdr_typed.items():
+        text = mdr[_col].astype("string")
+        missing = (text.isna() | text.isin(["", "None", "nan"])).fillna(False).astype(bool)
+        numbers = pd.to_numeric(text.where(~missing).astype(object), errors="coerce")
+        # Int8 holds integers from -128 to 127 only
+        invalid = ~missing & (numbers.isna() | (numbers % 1 != 0) | (numbers.abs() > 127))
+        if invalid.any():
+            msg = "Column '{}' cannot be written as {} (no integer) for: {}".format(
+                _col,
+                _dtype,
+                ", ".join("'{}' ({}, {}): '{}'".format(*_values) for _values in mdr.loc[
+                    invalid, ["designation", "source_system_type", "source_system_name",
+                              _col]].itertuples(index=False))
+            )
+            logging.error(msg)
+            raise Exception(msg)
+        mdr[_col] = numbers.astype(_dtype)
+    return mdr
+
+
+def mdr_concat(chunks: list):
+    # concatenate mdr chunks (with the dtypes of the schema); the
+    # categories are unified first, so that the columns stay categorical
+    if len(chunks) == 0:
+        return mdr_apply_schema(pd.DataFrame(columns=get_mdr_columns()))
+
+    for _col, _dtype in __mdr_schema.items():
+        if _dtype != "category":
+            continue
+        categories = union_categoricals(
+            [_chunk[_col] for _chunk in chunks], ignore_order=True).categories
+        for _chunk in chunks:
+            _chunk[_col] = _chunk[_col].cat.set_categories(categories)
+
+    return pd.concat(chunks, ignore_index=True)
+
+
+def mdr_validate(mdr: pd.DataFrame, main_system_name: str, main_system_type: str,
+                 variable_types: list):
+    # checks of the whole csv mdr before uploading it; returns a list with
+    # all problems found (empty, if the mdr is valid)
+    problems = []
+
+    # all columns, which are written to the data elements (the csv may
+    # contain further columns)
+    missing = [_col for _col in get_mdr_columns()
+               if _col != "dqa_assessment" and _col not in mdr.columns]
+    if len(missing) > 0:
+        problems.append("Missing columns: {}".format(", ".join(missing)))
+        return problems
+
+    # one row per variable and system (as required for the dqa slot)
+    system_keys = ["variable_name", "source_system_type", "source_system_name"]
+    duplicated = mdr[mdr.duplicated(subset=system_keys, keep=False)]
+    for _keys, _rows in duplicated.groupby(system_keys, observed=True, sort=False):
+        problems.append(
+            "Duplicate rows for variable_name '{}', source_system_type '{}', "
+            "source_system_name '{}': designations {}".format(
+                *_keys, list(_rows["designation"])))
+
+    # one row per data element for the main system
+    main_system_mdr = mdr[
+        (mdr["source_system_name"] == main_system_name) &
+        (mdr["source_system_type"] == main_system_type)]
+    duplicated = main_system_mdr["designation"][
+        main_system_mdr["designation"].duplicated()].unique()
+    for _designation in duplicated:
+        problems.append(
+            "Duplicate designation '{}' for main system '{}' ({}).".format(
+                _designation, main_system_name, main_system_type))
+
+    # the value domain of new data elements is built from variable_type
+    unknown = main_system_mdr["variable_type"][
+        ~main_system_mdr["variable_type"].isin(variable_types)].unique()
+    for _variable_type in unknown:
+        problems.append("Unknown variable_type '{}' (one of {}).".format(
+            _variable_type, ", ".join(_v for _v in variable_types if _v != "")))
+
+    # constraints are empty or json (each distinct value is parsed once)
+    def _is_json(value):
+        try:
+            json_loads(value)
+            return True
+        except ValueError:
+            return False
+
+    constraints = mdr["constraints"].astype("string").fillna("")
+    distinct = pd.Series(constraints[constraints != ""].unique())
+    malformed = set(distinct[~distinct.map(_is_json).astype(bool)])
+    for _designation, _constraints in mdr.loc[
+            constraints.isin(malformed), ["designation", "constraints"]].itertuples(
+                index=False):
+        problems.append("Malformed constraints (no json) for '{}': {}".format(
+            _designation, _constraints))
+
+    return problems
@@ -0,0 +1,209 @@
+#!/usr/bin/python
+
+# dqa-mdr-connector: Connecting the MIRACUM-MDR with the DQA-Tool
+# Copyright (C) 2022 Universitätsklinikum Erlangen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+__author__ = "Lorenz A. Kapsner, Moritz Stengel"
+__copyright__ = "Universitätsklinikum Erlangen"
+
+import os
+import bisect
+import logging
+import threading
+import time
+import urllib.parse as up
+
+
+# upper bounds (in seconds) of the latency histogram buckets
+__latency_buckets = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+
+
+def get_latency_buckets():
+    return __latency_buckets
+
+
+def get_endpoint_class(url: str, base_url: str):
+    # group urls by the api endpoint, e.g.
+    # ".../element/urn:x:dataelement:1:1/valuedomain" -> "valuedomain"
+    if not url.startswith(base_url):
+        return "auth"
+
+    parts = [_p for _p in up.urlparse(url[len(base_url):]).path.split("/") if _p]
+    if len(parts) == 0:
+        return "other"
+    if parts[0] == "namespaces":
+        return "namespace_members" if parts[-1] == "members" else "namespaces"
+    if parts[0] == "element":
+        return "valuedomain" if parts[-1] == "valuedomain" else "element"
+    return "other"
+
+
+def get_body_size(body):
+    if body is None:
+        return 0
+    if isinstance(body, str):
+        return len(body.encode("utf-8"))
+    if isinstance(body, bytes):
+        return len(body)
+    if isinstance(body, dict):
+        return len(up.urlencode(body))
+    return 0
+
+
+class RequestMetrics():
+
+    def __init__(self, hooks: list = None):
+        # counters and latency histograms of all http requests, aggregated
+        # by method and endpoint class; every request is also passed (as
+        # dict) to the callables in 'hooks'
+        self.hooks = [] if hooks is None else list(hooks)
+        self.requests = {}
+        self.endpoints = {}
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def record(self, method: str, endpoint: str, status, latency: float,
+               bytes_sent: int = 0, bytes_received: int = 0, retries: int = 0,
+               url: str = None):
+        # 'status' is the http status code or "error" (no response)
+        status = str(status)
+        with self._lock:
+            _key = (method, endpoint, status)
+            self.requests[_key] = self.requests.get(_key, 0) + 1
+
+            _endpoint = self.endpoints.get((method, endpoint))
+            if _endpoint is None:
+                _endpoint = {
+                    "count": 0,
+                    "latency_sum": 0.0,
+                    "buckets": [0] * (len(get_latency_buckets()) + 1),
+                    "bytes_sent": 0,
+                    "bytes_received": 0,
+                    "retries": 0
+                }
+                self.endpoints[(method, endpoint)] = _endpoint
+            _endpoint["count"] += 1
+            _endpoint["latency_sum"] += latency
+            _endpoint["buckets"][bisect.bisect_left(get_latency_buckets(), latency)] += 1
+            _endpoint["bytes_sent"] += bytes_sent
+            _endpoint["bytes_received"] += bytes_received
+            _endpoint["retries"] += retries
+
+        record = {
+            "method": method,
+            "url": url,
+            "endpoint": endpoint,
+            "status": status,
+            "latency": latency,
+            "bytes_sent": bytes_sent,
+            "bytes_received": bytes_received,
+            "retries": retries
+        }
+        for _hook in self.hooks:
+            try:
+                _hook(record)
+            except Exception as e:
+                logging.warning("Metrics hook failed: {}".format(e))
+
+    def summary(self):
+        # one dict per method and endpoint class
+        with self._lock:
+            summary = []
+            for (_method, _endpoint_class), _endpoint in sorted(self.endpoints.items()):
+                summary.append({
+                    "method": _method,
+                    "endpoint": _endpoint_class,
+                    "requests": _endpoint["count"],
+                    "failed": sum(
+                        _count for (_m, _e, _status), _count in self.requests.items()
+                        if _m == _method and _e == _endpoint_class and
+                        (_status == "error" or int(_status) >= 400)),
+                    "latency_mean": _endpoint["latency_sum"] / _endpoint["count"],
+                    "bytes_sent": _endpoint["bytes_sent"],
+                    "bytes_received": _endpoint["bytes_received"],
+                    "retries": _endpoint["retries"]
+                })
+            return summary
+
+    def to_prometheus(self, prefix: str = "dqa_mdr"):
+        # prometheus text exposition format
+        def _labels(**labels):
+            return "{" + ",".join(
+                '{}="{}"'.format(_k, _v) for _k, _v in labels.items()) + "}"
+
+        lines = []
+        with self._lock:
+            lines += [
+                "# HELP {}_requests_total Number of api requests.".format(prefix),
+                "# TYPE {}_requests_total counter".format(prefix)
+            ]
+            for (_method, _endpoint, _status), _count in sorted(self.requests.items()):
+                lines.append("{}_requests_total{} {}".format(
+                    prefix, _labels(method=_method, endpoint=_endpoint, status=_status),
+                    _count))
+
+            for _name, _field, _help in [
+                    ("request_retries_total", "retries", "Number of retries of api requests."),
+                    ("request_sent_bytes_total", "bytes_sent", "Bytes sent to the api."),
+                    ("request_received_bytes_total", "bytes_received",
+                     "Bytes received from the api.")]:
+                lines += [
+                    "# HELP {}_{} {}".format(prefix, _name, _help),
+                    "# TYPE {}_{} counter".format(prefix, _name)
+                ]
+                for (_method, _endpoint), _values in sorted(self.endpoints.items()):
+                    lines.append("{}_{}{} {}".format(
+                        prefix, _name, _labels(method=_method, endpoint=_endpoint),
+                        _values[_field]))
+
+            lines += [
+                "# HELP {}_request_duration_seconds Latency of api requests.".format(prefix),
+                "# TYPE {}_request_duration_seconds histogram".format(prefix)
+            ]
+            for (_method, _endpoint), _values in sorted(self.endpoints.items()):
+                _cumulative = 0
+                for _le, _count in zip(
+                        [str(_b) for _b in get_latency_buckets()] + ["+Inf"],
+                        _values["buckets"]):
+                    _cumulative += _count
+                    lines.append("{}_request_duration_seconds_bucket{} {}".format(
+                        prefix, _labels(method=_method, endpoint=_endpoint, le=_le),
+                        _cumulative))
+                lines.append("{}_request_duration_seconds_sum{} {}".format(
+                    prefix, _labels(method=_method, endpoint=_endpoint),
+                    _values["latency_sum"]))
+                lines.append("{}_request_duration_seconds_count{} {}".format(
+                    prefix, _labels(method=_method, endpoint=_endpoint),
+                    _values["count"]))
+
+        lines += [
+            "# HELP {}_last_run_timestamp_seconds End of the last run.".format(prefix),
+            "# TYPE {}_last_run_timestamp_seconds gauge".format(prefix),
+            "{}_last_run_timestamp_seconds {}".format(prefix, time.time())
+        ]
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, textfile: str, prefix: str = "dqa_mdr"):
+        # for the textfile collector of the node exporter, which must never
+        # see a partially written file
+        textfile = os.path.abspath(textfile)
+        tmp_file = textfile + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus(prefix=prefix))
+        os.replace(tmp_file, textfile)
+        logging.info("Metrics written to '{}'.".format(textfile))
@@ -0,0 +1,180 @@
+#!/usr/bin/python
+
+# dqa-mdr-connector: Connecting the MIRACUM-MDR with the DQA-Tool
+# Copyright (C) 2022 Universitätsklinikum Erlangen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+__author__ = "Lorenz A. Kapsner, Moritz Stengel"
+__copyright__ = "Universitätsklinikum Erlangen"
+
+import logging
+
+from dqa_mdr_connector.json_codec import json_loads
+
+
+# the json of a data element is built directly from the values of a csv
+# row: every builder returns a new dict, so nothing has to be copied
+
+
+def build_element(ns_urn: str, designation: str, definition: str, dqa_value: str,
+                  slots: list = None):
+    # data element with definition and "dqa" slot (followed by the further
+    # 'slots' of an existing data element)
+    return {
+        "identification": {
+            "elementType": "DATAELEMENT",
+            "namespaceUrn": ns_urn,
+            "status": "RELEASED"
+        },
+        "definitions": [{
+            "designation": designation,
+            "definition": definition,
+            "language": "en"
+        }],
+        "slots": [{"name": "dqa", "value": dqa_value}] + (slots or []),
+        "conceptAssociations": []
+    }
+
+
+def __valuedomain_string(constraints: dict, variable_type: str):
+    return {
+        "type": "STRING",
+        "text": {
+            "useRegEx": True,
+            "regEx": constraints["regex"],
+            "useMaximumLength": True,
+            "maximumLength": 0
+        }
+    }
+
+
+def __valuedomain_default(constraints: dict, variable_type: str):
+    # no "variable_type" defined: string value domain, constraints are
+    # not used
+    return {
+        "type": "STRING",
+        "text": {
+            "useRegEx": "",
+            "regEx": "",
+            "useMaximumLength": True,
+            "maximumLength": 0
+        }
+    }
+
+
+def __valuedomain_datetime(constraints: dict, variable_type: str):
+    return {
+        "type": "DATETIME",
+        "datetime": {
+            "date": constraints["date"]["date"],
+            "time": constraints["date"]["time"],
+            "hourFormat": constraints["date"]["hourFormat"]
+        }
+    }
+
+
+def __valuedomain_enumerated(constraints: dict, variable_type: str):
+    return {
+        "type": "ENUMERATED",
+        "permittedValues": [{
+            "definitions": [{
+                "designation": _val,
+                "definition": _val,
+                "language": "en"
+            }],
+            "value": _val
+        } for _val in constraints["value_set"].split(", ")]
+    }
+
+
+def __valuedomain_numeric(constraints: dict, variable_type: str):
+    return {
+        "type": "NUMERIC",
+        "numeric": {
+            "type": variable_type.upper(),
+            "useMinimum": True,
+            "useMaximum": True,
+            "unitOfMeasure": constraints["range"]["unit"],
+            "minimum": constraints["range"]["min"],
+            "maximum": constraints["range"]["max"]
+        }
+    }
+
+
+def __valuedomain_boolean(constraints: dict, variable_type: str):
+    return {
+        "type": "BOOLEAN"
+    }
+
+
+# value domain builder per variable_type of the csv file (as written by
+# GetMDR)
+__valuedomain_builders = {
+    "": __valuedomain_default,
+    "string": __valuedomain_string,
+    "datetime": __valuedomain_datetime,
+    "enumerated": __valuedomain_enumerated,
+    "float": __valuedomain_numeric,
+    "integer": __valuedomain_numeric,
+    "boolean": __valuedomain_boolean
+}
+
+# variable_types, whose builder does not use the constraints (they are not
+# parsed, as they are usually empty)
+__valuedomain_without_constraints = {"boolean"}
+
+
+def register_valuedomain_builder(variable_type: str, builder,
+                                 uses_constraints: bool = True):
+    # builder(constraints: dict, variable_type: str) returns the value
+    # domain of a new data element
+    __valuedomain_builders[variable_type] = builder
+    if uses_constraints:
+        __valuedomain_without_constraints.discard(variable_type)
+    else:
+        __valuedomain_without_constraints.add(variable_type)
+
+
+def get_variable_types():
+    return list(__valuedomain_builders.keys())
+
+
+def build_valuedomain(variable_type: str, constraints: str):
+    # value domain of a new data element from 'variable_type' and the
+    # (json) constraints of its csv row; if the constraints cannot be used,
+    # a string value domain without regex is returned
+    builder = __valuedomain_builders.get(variable_type)
+    if builder is None:
+        msg = "No value domain for variable_type '{}' (one of {}).".format(
+            variable_type, ", ".join(_v for _v in get_variable_types() if _v != ""))
+        logging.error(msg)
+        raise Exception(msg)
+
+    if variable_type in __valuedomain_without_constraints:
+        return builder({}, variable_type)
+
+    try:
+        return builder(json_loads(constraints), variable_type)
+    except Exception as e:
+        logging.error(e)
+        return {
+            "type": "STRING",
+            "text": {
+                "useRegEx": False,
+                "regEx": "",
+                "useMaximumLength": True,
+                "maximumLength": 0
+            }
+        }
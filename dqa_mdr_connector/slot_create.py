@@ -20,9 +20,9 @@ __author__ = "Lorenz A. Kapsner, Moritz Stengel"
 __copyright__ = "Universitätsklinikum Erlangen"
 
 
-import json
 import pandas as pd
-import copy
+
+from dqa_mdr_connector.json_codec import json_dumps
 
 
 __slot_base_value = {
@@ -43,71 +43,82 @@ __slot_system_value = {
 }
 
 
-def slot_create_dqa_value(mdr: pd.DataFrame, mdr_row: pd.Series):
+def slot_create_index(mdr: pd.DataFrame):
+    # group all rows of the mdr once by 'variable_name',
+    # 'source_system_type' and 'source_system_name' (keeping the order of
+    # first appearance), so that creating the slot of one data element
+    # does not need to scan the whole mdr
+    mdr_index = {}
+
+    for _label, _record in zip(mdr.index, mdr.to_dict("records")):
+        mdr_index.setdefault(
+            _record["variable_name"], {}
+        ).setdefault(
+            _record["source_system_type"], {}
+        ).setdefault(
+            _record["source_system_name"], []
+        ).append((_label, _record))
+
+    return mdr_index
+
+
+def slot_create_dqa_value(mdr: pd.DataFrame, mdr_row: pd.Series, mdr_index: dict = None):
+
+    if mdr_index is None:
+        mdr_index = slot_create_index(mdr=mdr)
 
     # begin from here to create "callable" funciton for dqa-mdr-connector
     # Every System designation within database (eg. Person.Demographie.AdministrativesGeschlecht)
-    all_systems = mdr[mdr["variable_name"] == mdr_row["variable_name"]]
-
-    # drop duplicates of source system types #maybe need a deepcopy here
-    available_source_system_types = all_systems["source_system_type"].unique()
+    all_systems = mdr_index.get(mdr_row["variable_name"], {})
 
     # create base_slot here with available information which is common over all data system types
-    # get json template container
-    manipulate_slot_base_value = copy.deepcopy(__slot_base_value)
+    # new json container (as __slot_base_value, without copying it)
+    manipulate_slot_base_value = {"available_systems": {}}
 
     # fill in variables common across system types
     #manipulate_slot_base_value["variable_name"] = mdr_row["variable_name"]
     #manipulate_slot_base_value["key"] = mdr_row["key"]
 
     # for each dataelement, loop over several system types that are available in the csv file
-    for system_type in available_source_system_types:
-
-        # # drop duplicates of source system names #maybe need a deepcopy here
-        available_source_system_names = all_systems[
-            all_systems["source_system_type"] == system_type]["source_system_name"].unique(
-        )
-
-        # subset data for source system type
-        data_for_system_type = all_systems[
-            (all_systems["source_system_type"] == system_type)]
+    for system_type, data_for_system_type in all_systems.items():
 
         manipulate_slot_base_value["available_systems"][system_type] = {}
 
         # for each system type, loop over system names (different databases of one type)
-        for system_name in available_source_system_names:
-
-            # subset data for source system name
-            data_for_system_name = data_for_system_type[
-                (data_for_system_type["source_system_name"] == system_name)]
+        for system_name, data_for_system_name in data_for_system_type.items():
 
             if len(data_for_system_name) != 1:
+                # collect all rows of this system type for the error message
+                system_type_labels = [
+                    _label for _rows in data_for_system_type.values() for _label, _ in _rows]
                 raise Exception("Error: For one distinct dataelement, here should be only \
                     one row for each 'source_system_type' and 'source_system_name'.\n \
                         Please make sure your MDR is correctly formatted. \n \
                         designation: {}\n \
                         source_system_name: {}\n \
                         source_system_type: {}".format(
-                    data_for_system_type["designation"],
+                    mdr.loc[mdr.index.isin(system_type_labels), "designation"],
                     system_type,
                     system_name
                 ))
 
-            # copy json template
-            manipulate_slot_system_value = copy.deepcopy(__slot_system_value)
+            system_name_data = data_for_system_name[0][1]
+
+            # copy json template (shallow, all values are flat)
+            manipulate_slot_system_value = dict(__slot_system_value)
 
             # fill template with system specific info
-            manipulate_slot_system_value["filter"] = data_for_system_name.iloc[0]["filter"]
-            manipulate_slot_system_value["source_variable_name"] = data_for_system_name.iloc[0]["source_variable_name"]
-            manipulate_slot_system_value["source_table_name"] = data_for_system_name.iloc[0]["source_table_name"]
-            manipulate_slot_system_value["constraints"] = data_for_system_name.iloc[0]["constraints"]
-            manipulate_slot_system_value["plausibility_relation"] = data_for_system_name.iloc[0]["plausibility_relation"]
-            manipulate_slot_system_value["data_map"] = data_for_system_name.iloc[0]["data_map"]
-            manipulate_slot_system_value["restricting_date_var"] = data_for_system_name.iloc[0]["restricting_date_var"]
-            manipulate_slot_system_value["restricting_date_format"] = data_for_system_name.iloc[0]["restricting_date_format"]
+            manipulate_slot_system_value["filter"] = system_name_data["filter"]
+            manipulate_slot_system_value["source_variable_name"] = system_name_data["source_variable_name"]
+            manipulate_slot_system_value["source_table_name"] = system_name_data["source_table_name"]
+            manipulate_slot_system_value["constraints"] = system_name_data["constraints"]
+            manipulate_slot_system_value["plausibility_relation"] = system_name_data["plausibility_relation"]
+            manipulate_slot_system_value["data_map"] = system_name_data["data_map"]
+            manipulate_slot_system_value["restricting_date_var"] = system_name_data["restricting_date_var"]
+            manipulate_slot_system_value["restricting_date_format"] = system_name_data["restricting_date_format"]
 
             # append filled template to list of systems for that system type
             manipulate_slot_base_value["available_systems"][system_type][
                 system_name] = manipulate_slot_system_value
 
-    return json.dumps(manipulate_slot_base_value)
+    return json_dumps(manipulate_slot_base_value)
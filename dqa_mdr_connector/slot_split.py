@@ -23,43 +23,59 @@ __copyright__ = "Universitätsklinikum Erlangen"
 import pandas as pd
 
 
-def slot_split(json_slot: dict, designation: str, definition: str):
-    base_row = {}
-    base_row["designation"] = designation
-    base_row["definition"] = definition
-    #base_row["variable_name"] = json_slot["variable_name"]
-    #base_row["key"] = json_slot["key"]
+__slot_system_fields = [
+    "filter",
+    "source_variable_name",
+    "source_table_name",
+    "constraints",
+    "plausibility_relation",
+    "data_map",
+    "restricting_date_var",
+    "restricting_date_format"
+]
+
 
-    manipulate_mdr = pd.DataFrame()
+def slot_split_rows(json_slot: dict, designation: str, definition: str):
+    # flatten one dqa slot to a list of plain dicts
+    # (one row per 'source_system_type' and 'source_system_name')
+    rows = []
 
-    for system_type in json_slot["available_systems"].keys():
-        for system_name in json_slot["available_systems"][system_type].keys():
+    for system_type, system_names in json_slot["available_systems"].items():
+        for system_name, system_name_data in system_names.items():
 
-            system_name_row = {"source_system_type": system_type,
-                               "source_system_name": system_name}
+            system_name_row = {
+                "designation": designation,
+                "definition": definition,
+                "source_system_type": system_type,
+                "source_system_name": system_name,
+                "dqa_assessment": str(system_name_data["dqa_assessment"])
+            }
+            for _field in __slot_system_fields:
+                system_name_row[_field] = system_name_data[_field]
 
-            system_name_data = json_slot["available_systems"][system_type][system_name]
+            rows.append(system_name_row)
 
-            system_name_row["dqa_assessment"] = str(
-                system_name_data["dqa_assessment"])
-            system_name_row["filter"] = system_name_data["filter"]
-            system_name_row["source_variable_name"] = system_name_data["source_variable_name"]
-            system_name_row["source_table_name"] = system_name_data["source_table_name"]
-            system_name_row["constraints"] = system_name_data["constraints"]
-            system_name_row["plausibility_relation"] = system_name_data["plausibility_relation"]
-            system_name_row["data_map"] = system_name_data["data_map"]
-            system_name_row["restricting_date_var"] = system_name_data["restricting_date_var"]
-            system_name_row["restricting_date_format"] = system_name_data["restricting_date_format"]
+    return rows
 
-            # filter, source_variable_name, source_table_name
 
-            system_name_dict = {**base_row, **system_name_row}
+def slot_split_batch(slots: list):
+    # flatten the dqa slots of many data elements at once;
+    # 'slots' is a list of dicts with the keys 'json_slot', 'designation'
+    # and 'definition'. The data frame is constructed only once.
+    rows = []
+    for _slot in slots:
+        rows.extend(slot_split_rows(
+            json_slot=_slot["json_slot"],
+            designation=_slot["designation"],
+            definition=_slot["definition"]
+        ))
 
-            manipulate_mdr = pd.concat(
-                [manipulate_mdr, pd.DataFrame(system_name_dict, index=[0])],
-                ignore_index=True,
-                axis=0,
-                join="outer"
-            )
+    return pd.DataFrame(data=rows)
 
-    return manipulate_mdr
+
+def slot_split(json_slot: dict, designation: str, definition: str):
+    return slot_split_batch(slots=[{
+        "json_slot": json_slot,
+        "designation": designation,
+        "definition": definition
+    }])
@@ -0,0 +1,81 @@
+#!/usr/bin/python
+
+# dqa-mdr-connector: Connecting the MIRACUM-MDR with the DQA-Tool
+# Copyright (C) 2022 Universitätsklinikum Erlangen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+__author__ = "Lorenz A. Kapsner, Moritz Stengel"
+__copyright__ = "Universitätsklinikum Erlangen"
+
+import os
+import json
+import logging
+import threading
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:
+    Fernet = None
+
+
+class TokenCache():
+
+    def __init__(self, cache_file: str, key: str = None):
+        # oauth tokens, encrypted at rest (fernet); the key is taken from
+        # 'key' or the environment variable DQA_MDR_TOKEN_KEY and can be
+        # generated with 'cryptography.fernet.Fernet.generate_key()'
+        if Fernet is None:
+            msg = "The token cache requires the package 'cryptography' " + \
+                "(pip install dqa_mdr_connector[token-cache])."
+            logging.error(msg)
+            raise Exception(msg)
+
+        if key is None:
+            key = os.environ.get("DQA_MDR_TOKEN_KEY")
+        if key is None:
+            msg = "No key for the token cache: set 'token_cache_key' or " + \
+                "the environment variable DQA_MDR_TOKEN_KEY."
+            logging.error(msg)
+            raise Exception(msg)
+
+        self.fernet = Fernet(key)
+        self.cache_file = os.path.abspath(cache_file)
+        self._lock = threading.Lock()
+
+    def read(self):
+        try:
+            with open(self.cache_file, "rb") as f:
+                return json.loads(self.fernet.decrypt(f.read()))
+        except OSError:
+            return {}
+        except (InvalidToken, ValueError):
+            logging.warning("Ignoring unreadable token cache '{}'.".format(
+                self.cache_file))
+            return {}
+
+    def get(self, key: str):
+        return self.read().get(key)
+
+    def set(self, key: str, entry: dict):
+        with self._lock:
+            entries = self.read()
+            entries[key] = entry
+
+            # only readable by the current user
+            tmp_file = self.cache_file + ".tmp"
+            fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "wb") as f:
+                f.write(self.fernet.encrypt(json.dumps(entries).encode("utf-8")))
+            os.replace(tmp_file, self.cache_file)
@@ -30,9 +30,16 @@ from requests.models import HTTPBasicAuth
 import json
 import logging
 import copy
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 
 from dqa_mdr_connector.api_connection import ApiConnector
-from dqa_mdr_connector.slot_create import slot_create_dqa_value
+from dqa_mdr_connector.element_store import ElementStore
+from dqa_mdr_connector.journal import Journal
+from dqa_mdr_connector.json_codec import json_body, json_loads
+from dqa_mdr_connector.mdr_schema import mdr_apply_schema, mdr_concat, mdr_validate
+from dqa_mdr_connector.payload_builder import build_element, build_valuedomain, get_variable_types
+from dqa_mdr_connector.slot_create import slot_create_dqa_value, slot_create_index
 
 # api doc: https://rest.demo.dataelementhub.de/swagger-ui/index.html?configUrl=/v3/api-docs/swagger-config
 # dicovery doc: https://www.keycloak.org/docs/4.8/authorization_services/#_service_authorization_api
@@ -47,6 +54,12 @@ class UpdateMDR(ApiConnector):
             main_system_name: str = "i2b2",
             main_system_type: str = "postgres",
             de_fhir_paths: list = None,
+            element_store_size: int = 10000,
+            element_store_dir: str = None,
+            max_workers: int = 1,
+            journal_file: str = None,
+            fhir_index_file: str = None,
+            csv_chunksize: int = 100000,
             **kwargs
     ):
 
@@ -54,18 +67,43 @@ class UpdateMDR(ApiConnector):
         if "namespace_definition" in kwargs.keys():
             self.namespace_definition = kwargs.pop("namespace_definition")
 
+        # make sure the connection pool is large enough for all workers
+        kwargs.setdefault("pool_maxsize", max(10, max_workers or 1))
+
+        self.csv_file_name = csv_file
+
+        # read database (in chunks of 'csv_chunksize' rows) and check it
+        # before connecting to the api
+        self.read_csv_mdr(separator=separator, chunksize=csv_chunksize)
+        self.validate_mdr(
+            main_system_name=main_system_name,
+            main_system_type=main_system_type
+        )
+
         # initialize apiconnector
         super().__init__(download=False, **kwargs)
 
-        self.de_fhir_paths = de_fhir_paths
+        self.main_system_name = main_system_name
+        self.main_system_type = main_system_type
 
-        self.csv_file_name = csv_file
+        # number of csv rows that are uploaded in parallel
+        self.max_workers = max_workers
 
-        # init templates
-        self.init_templates()
+        # optional journal for resuming an interrupted upload
+        self.journal_file = journal_file
+        self.journal = None
+
+        self.de_fhir_paths = de_fhir_paths
+        # set for fast membership checks
+        self.de_fhir_paths_set = None if de_fhir_paths is None else set(de_fhir_paths)
+        # optional persisted fhir-path -> urn index, so that only the
+        # wanted data elements are fetched, if de_fhir_paths is set
+        self.fhir_index_file = fhir_index_file
 
-        # read database
-        self.read_csv_mdr(separator=separator)
+        # data elements fetched during one run are kept in memory (up to
+        # element_store_size elements) or spilled to element_store_dir
+        self.element_store_size = element_store_size
+        self.element_store_dir = element_store_dir
 
         # MDR = self.database
         # now create main_system_mdr with unique dataelements only (no duplicate designation)
@@ -74,335 +112,797 @@ class UpdateMDR(ApiConnector):
             (self.database["source_system_name"] == main_system_name) &
             (self.database["source_system_type"] == main_system_type)]
 
-        if len(self.main_system_mdr) != \
-                len(self.main_system_mdr[["designation", "key", "variable_name"]]):
-            raise Exception(
-                "main_system_mdr contains duplicate entries of data elements.")
-
     def __call__(self):
+        self.start_run()
+        completed = False
+        try:
+            results = self.update_namespace()
+            completed = True
+        finally:
+            self.end_run(completed=completed)
+
+        return results
+
+    def start_run(self, journal_identity: dict = None):
+        self.open_element_store()
+        if self.journal_file is not None:
+            self.journal = Journal(
+                journal_file=self.journal_file,
+                identity=self.get_journal_identity() if journal_identity is None
+                else journal_identity
+            )
 
-        # define some empty containers for later
-        mdr_de_designations = {}
+    def get_journal_identity(self):
+        # the journal is only resumed for the same namespace and the same
+        # (unchanged) csv file, as its uploaded rows are keyed by designation
+        return {
+            "run": "UpdateMDR",
+            "api_url": self.base_url,
+            "namespace_designation": self.namespace_designation,
+            "csv_file": os.path.abspath(self.csv_file_name),
+            "csv_sha256": self.get_file_hash(self.csv_file_name),
+            "main_system_name": self.main_system_name,
+            "main_system_type": self.main_system_type,
+            "de_fhir_paths": self.de_fhir_paths
+        }
 
-        # test, if namespace already exists in remote-mdr
-        # if namespace exists, self.ns_id is set
-        self.check_if_namespace_exists()
+    @staticmethod
+    def get_file_hash(file_name: str):
+        sha256 = hashlib.sha256()
+        with open(file_name, "rb") as f:
+            for _block in iter(lambda: f.read(1024 * 1024), b""):
+                sha256.update(_block)
+        return sha256.hexdigest()
+
+    def open_element_store(self):
+        # store for the data elements fetched in this run
+        self.element_store = ElementStore(
+            max_in_memory=self.element_store_size,
+            spill_dir=self.element_store_dir
+        )
 
-        if self.ns_id is None:
-            logging.info("Namespace '' does not exist.\n".format(
-                self.namespace_designation))
+    def end_run(self, completed: bool):
+        self.element_store.close()
+        self.write_metrics()
 
-            msg = "No or multiple namespaces found at '{}' for namespace_designation '{}'.\n \
-                Creating new namespace.".format(
-                self.base_url,
-                self.namespace_designation
-            )
-            logging.warning(msg)
-
-            create_ns = {
-                "identification": {
-                    "elementType": "NAMESPACE",
-                    "hideNamespace": True,
-                    "status": "RELEASED"
-                },
-                "definitions": [
-                    {
-                        "designation": self.namespace_designation,
-                        "definition": self.namespace_definition,
-                        "language": "en"
-                    }
-                ]
-            }
+        # the journal is only needed, if some rows have to be uploaded again
+        if self.journal is not None:
+            self.journal.close(
+                remove=completed and self.summary["failed"] == 0)
+            self.journal = None
 
-            response = requests.post(
-                url=self.base_url + "namespaces/",
-                data=json.dumps(create_ns),
-                headers=self.header
+    def update_namespace(self):
+        urn_designation_mapping = self.read_namespace()
+        if self.ns_id is None:
+            self.create_namespace()
+
+        # update existing / create new dataelements
+        # (rows are uploaded concurrently, if max_workers > 1)
+        rows, build_request, _ = self.prepare_upload(
+            urn_designation_mapping=urn_designation_mapping)
+        return self.summarize(results=self.map_rows(
+            lambda _row: self.upload_row(_row=_row, build_request=build_request),
+            rows
+        ))
+
+    def prepare_upload(self, urn_designation_mapping: dict):
+        # the rows of the csv file, a function building the request of one
+        # row and the csv designations of the existing data elements
+        # (designation -> urn); the namespace has to exist already
+
+        # index the mdr once by variable_name / system type / system name
+        # for creating the dqa slots
+        mdr_index = slot_create_index(mdr=self.database)
+
+        mdr_de_designations = self.match_designations(
+            urn_designation_mapping=urn_designation_mapping)
+
+        def _build_request(_row):
+            return self.build_request(
+                _row=_row,
+                mdr_index=mdr_index,
+                mdr_de_designations=mdr_de_designations,
+                urn_designation_mapping=urn_designation_mapping
             )
 
-            # log response
-            logging.info(response)
+        rows = [_row for _i, _row in self.main_system_mdr.iterrows()]
+        return rows, _build_request, mdr_de_designations
 
-            # now, namespace exists, set self.ns_id
-            self.check_if_namespace_exists()
+    def map_rows(self, function, rows: list):
+        if self.max_workers is None or self.max_workers <= 1:
+            return [function(_row) for _row in rows]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(function, rows))
 
-        else:
+    def create_namespace(self):
+        response = self.post_to_api(
+            url=self.base_url + "namespaces/",
+            data=json_body(self.get_namespace_payload()),
+            header=self.header
+        )
+
+        # log response
+        logging.info("Namespace created: {}".format(response.status_code))
+
+        # now, namespace exists, set self.ns_id
+        self.check_if_namespace_exists()
+
+    def read_namespace(self):
+        # fetch (and register) the data elements of the remote namespace;
+        # returns the urn -> designations mapping, self.ns_id is None, if
+        # the namespace does not exist
+        urn_designation_mapping = {}
+
+        # test, if namespace already exists in remote-mdr
+        # if namespace exists, self.ns_id is set
+        self.check_if_namespace_exists()
+
+        if self.ns_id is not None:
             logging.info("Namespace '{}' already exists.\n".format(
                 self.namespace_designation))
-            namespace_dataelement_urns = self.get_namespace_urns(
+            namespace_dataelements = self.get_namespace_members(
                 ns_id=self.ns_id)
 
-            urn_designation_mapping = {}
+            prefetched = {}
+            if self.use_fhir_index():
+                namespace_dataelements, prefetched = self.filter_members_by_fhir_path(
+                    members=namespace_dataelements,
+                    de_fhir_paths=self.de_fhir_paths,
+                    fhir_index_file=self.fhir_index_file,
+                    max_workers=self.max_workers
+                )
 
             # get designation for each urn
-            for _dataelement_urn in namespace_dataelement_urns:
-                # get data element from mdr
-                response, ns_dataelement_url = self.get_element_by_urn(
-                    urn=_dataelement_urn
+            for _member in namespace_dataelements:
+                _dataelement_urn = _member["elementUrn"]
+                self.register_element(
+                    urn=_dataelement_urn,
+                    response=self.get_element(urn=_dataelement_urn, prefetched=prefetched),
+                    urn_designation_mapping=urn_designation_mapping
                 )
 
-                # check for fhir path
-                fhir_path = [s for s in response["slots"] if s["name"] == "fhir-path"]
-                if len(fhir_path) == 1:
-                    if not fhir_path[0]["value"] in self.de_fhir_paths:
-                        # continue loop, if this dataelement is not wanted
-                        continue
-                else:
-                    continue
+        return urn_designation_mapping
+
+    def use_fhir_index(self):
+        return self.de_fhir_paths is not None and self.fhir_index_file is not None
+
+    def get_known_element(self, urn: str, prefetched: dict):
+        # data element fetched by the fhir index or by an interrupted run
+        # (journal); None, if it has to be fetched
+        if urn in prefetched:
+            return prefetched.pop(urn)
+        if self.journal is not None and urn in self.journal.fetched:
+            return self.journal.fetched[urn]
+        return None
+
+    def record_element(self, urn: str, response: dict):
+        if self.journal is not None:
+            self.journal.record_fetched(urn=urn, data=response)
+        return response
+
+    def get_element(self, urn: str, prefetched: dict):
+        # get data element from mdr (or from the journal of an
+        # interrupted run)
+        response = self.get_known_element(urn=urn, prefetched=prefetched)
+        if response is not None:
+            return response
+        response, ns_dataelement_url = self.get_element_by_urn(urn=urn)
+        return self.record_element(urn=urn, response=response)
+
+    def save_snapshot(self, snapshot_file: str):
+        # save the remote namespace (its wanted data elements) to plan
+        # offline later on
+        self.open_element_store()
+        try:
+            self.write_snapshot(
+                snapshot_file=snapshot_file,
+                urn_designation_mapping=self.read_namespace()
+            )
+        finally:
+            self.element_store.close()
+
+    def write_snapshot(self, snapshot_file: str, urn_designation_mapping: dict):
+        elements = {_urn: self.element_store.get(urn=_urn)
+                    for _urn in urn_designation_mapping.keys()}
+
+        tmp_file = snapshot_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump({
+                "namespace_designation": self.namespace_designation,
+                "ns_id": self.ns_id,
+                "ns_urn": self.ns_urn,
+                "de_fhir_paths": self.de_fhir_paths,
+                "elements": elements
+            }, f)
+        os.replace(tmp_file, snapshot_file)
+        logging.info("Snapshot of {} dataelements written to '{}'.".format(
+            len(elements), snapshot_file))
+
+    def read_snapshot(self, snapshot_file: str):
+        # like read_namespace, but without any request
+        with open(snapshot_file, "r", encoding="utf-8") as f:
+            snapshot = json.load(f)
+
+        if snapshot["namespace_designation"] != self.namespace_designation:
+            msg = "Snapshot '{}' is for namespace '{}', not '{}'".format(
+                snapshot_file,
+                snapshot["namespace_designation"],
+                self.namespace_designation
+            )
+            logging.error(msg)
+            raise Exception(msg)
 
-                multi_designation_list = []
+        self.ns_id = snapshot["ns_id"]
+        self.ns_urn = snapshot["ns_urn"]
 
-                for _element in response["definitions"]:
-                    multi_designation_list.append(_element["designation"])
+        urn_designation_mapping = {}
+        for _urn, _element in snapshot["elements"].items():
+            self.register_element(
+                urn=_urn,
+                response=_element,
+                urn_designation_mapping=urn_designation_mapping
+            )
+        return urn_designation_mapping
+
+    def plan(self, snapshot_file: str = None, plan_file: str = None):
+        # dry run: reconcile the csv file with the remote namespace (or with
+        # a snapshot of it, without any request) and return the changes,
+        # which __call__ would make; no write requests are sent.
+        # The plan is saved to 'plan_file' (json) for apply_plan.
+        self.open_element_store()
+        try:
+            if snapshot_file is None:
+                urn_designation_mapping = self.read_namespace()
+            else:
+                urn_designation_mapping = self.read_snapshot(snapshot_file=snapshot_file)
+            return self.make_plan(
+                urn_designation_mapping=urn_designation_mapping,
+                plan_file=plan_file
+            )
+        finally:
+            self.element_store.close()
+
+    def make_plan(self, urn_designation_mapping: dict, plan_file: str = None):
+        rows, build_request, mdr_de_designations = self.prepare_upload(
+            urn_designation_mapping=urn_designation_mapping)
+
+        changes = []
+        for _row in rows:
+            try:
+                request = build_request(_row)
+            except Exception as e:
+                result = self.get_failed_result(_row=_row, error=e)
+                changes.append({**result, "method": None, "url": None,
+                                "payload": None, "diff": None})
+                continue
+            changes.append(self.get_planned_change(request=request))
+
+        # remote data elements without a row in the csv file
+        matched_urns = set(mdr_de_designations.values())
+        unmatched = [
+            {"urn": _urn, "designation": _mapping["designation"]}
+            for _urn, _mapping in urn_designation_mapping.items()
+            if _urn not in matched_urns
+        ]
+
+        summary = {_action: 0 for _action in ["created", "updated", "unchanged", "failed"]}
+        for _change in changes:
+            summary[_change["action"]] += 1
+        summary["unmatched"] = len(unmatched)
+        logging.info(
+            "Plan: create {created}, update {updated}, unchanged {unchanged}, "
+            "failed {failed}, unmatched {unmatched}".format(**summary))
+
+        plan = {
+            "namespace_designation": self.namespace_designation,
+            "ns_urn": self.ns_urn,
+            "summary": summary,
+            "changes": changes,
+            "unmatched": unmatched
+        }
+        if plan_file is not None:
+            with open(plan_file, "w", encoding="utf-8") as f:
+                json.dump(plan, f, indent=2)
+        return plan
+
+    def get_planned_change(self, request: dict):
+        change = {
+            "designation": request["designation"],
+            "action": request["action"],
+            "urn": request["urn"],
+            "method": request["method"],
+            "url": request["url"],
+            "payload": request["payload"] if request["method"] is not None else None,
+            "diff": None,
+            "error": None
+        }
+        if request["action"] == "updated":
+            change["diff"] = self.element_diff(
+                old=self.normalize_element(request["remote"]),
+                new=self.normalize_element(request["payload"])
+            )
+        return change
+
+    def apply_plan(self, plan):
+        # send the writes of a plan (dict or json file of self.plan) and
+        # nothing else; returns the status of each row like __call__
+        plan = self.read_plan(plan=plan)
+
+        self.start_run(journal_identity=self.get_plan_identity(plan=plan))
+        completed = False
+        try:
+            results = self.apply_changes(changes=plan["changes"])
+            completed = True
+        finally:
+            self.end_run(completed=completed)
+
+        return results
+
+    def read_plan(self, plan):
+        if isinstance(plan, str):
+            with open(plan, "r", encoding="utf-8") as f:
+                plan = json.load(f)
+
+        if plan["namespace_designation"] != self.namespace_designation:
+            msg = "Plan is for namespace '{}', not '{}'".format(
+                plan["namespace_designation"],
+                self.namespace_designation
+            )
+            logging.error(msg)
+            raise Exception(msg)
+        return plan
+
+    def get_plan_identity(self, plan: dict):
+        # the journal is only resumed for the same plan
+        return {
+            "run": "UpdateMDR.apply_plan",
+            "api_url": self.base_url,
+            "namespace_designation": self.namespace_designation,
+            "changes_sha256": hashlib.sha256(json.dumps(
+                plan["changes"], sort_keys=True).encode("utf-8")).hexdigest()
+        }
+
+    def apply_changes(self, changes: list):
+        self.check_if_namespace_exists()
+        if self.ns_id is None:
+            self.create_namespace()
+
+        return self.summarize(results=self.map_rows(self.apply_change, changes))
+
+    def apply_change(self, change: dict):
+        result, request = self.prepare_change(change=change)
+        if result is not None:
+            return result
+        return self.send_change(request=request)
+
+    def prepare_change(self, change: dict):
+        # returns the result of a planned change, which is not sent, or the
+        # request to send
+        result = self.get_journal_result(_row=change)
+        if result is not None:
+            return result, None
+        if change["action"] == "failed":
+            return {_k: change[_k] for _k in
+                    ["designation", "action", "urn", "status_code", "error"]}, None
+        # urls are built for this api_url (the plan may have been made
+        # with a snapshot of another instance)
+        change = copy.deepcopy(change)
+        if change["method"] == "PUT":
+            change["url"] = self.get_element_url(urn=change["urn"])
+        elif change["method"] == "POST":
+            change["url"] = up.urljoin(self.base_url, "element")
+            # the namespace may have been created just now
+            change["payload"]["identification"]["namespaceUrn"] = self.ns_urn
+        return None, change
+
+    def get_namespace_payload(self):
+        logging.info("Namespace '{}' does not exist.\n".format(
+            self.namespace_designation))
+
+        msg = "No or multiple namespaces found at '{}' for namespace_designation '{}'.\n \
+            Creating new namespace.".format(
+            self.base_url,
+            self.namespace_designation
+        )
+        logging.warning(msg)
 
-                urn_designation_mapping[_dataelement_urn] = {
-                    "designation": multi_designation_list,
-                    "valueDomainUrn": response["valueDomainUrn"]
+        create_ns = {
+            "identification": {
+                "elementType": "NAMESPACE",
+                "hideNamespace": True,
+                "status": "RELEASED"
+            },
+            "definitions": [
+                {
+                    "designation": self.namespace_designation,
+                    "definition": self.namespace_definition,
+                    "language": "en"
                 }
+            ]
+        }
+        return create_ns
+
+    def register_element(self, urn: str, response: dict, urn_designation_mapping: dict):
+        # check for fhir path
+        if self.de_fhir_paths is not None:
+            fhir_path = [s for s in response["slots"] if s["name"] == "fhir-path"]
+            if len(fhir_path) == 1:
+                if not fhir_path[0]["value"] in self.de_fhir_paths_set:
+                    # skip, if this dataelement is not wanted
+                    return
+            else:
+                return
 
-            # lookup -> get elements of csv-file that are already present in mdr
-            # mdr data element designations
-            for _urn, _de_designations in urn_designation_mapping.items():
-                while True:
-                    for _de_designation in _de_designations["designation"]:
-                        if _de_designation in self.main_system_mdr["designation"].values:
-                            mdr_de_designations[_de_designation] = _urn
-                            # if correct designation found within set of designations,
-                            # skip for-loop
-                            break
-                    break
+        multi_designation_list = []
 
-        # update existing dataelements
-        for _i, _row in self.main_system_mdr.iterrows():
-            _designation = _row["designation"]
-            _definition = _row["definition"]
+        for _element in response["definitions"]:
+            multi_designation_list.append(_element["designation"])
 
-            logging.info("Dataelement: {}\n\n".format(_designation))
+        urn_designation_mapping[urn] = {
+            "designation": multi_designation_list,
+            "valueDomainUrn": response["valueDomainUrn"]
+        }
 
-            # define basic json container
-            de_basetemp = copy.deepcopy(self._de_json_template)
-            # get _ns_urn elswhere, write to "self.ns_urn"
-            de_basetemp["identification"]["namespaceUrn"] = self.ns_urn
+        # keep the element for the update below
+        self.element_store.put(urn=urn, element=response)
 
-            # fill definition template
-            de_definition_temp = copy.deepcopy(
-                self._de_definition_json_template)
-            de_definition_temp["designation"] = _designation
-            de_definition_temp["definition"] = _definition
+    def match_designations(self, urn_designation_mapping: dict):
+        # lookup -> get elements of csv-file that are already present in mdr
+        # mdr data element designations
+        mdr_de_designations = {}
+        main_system_designations = set(self.main_system_mdr["designation"])
+        for _urn, _de_designations in urn_designation_mapping.items():
+            for _de_designation in _de_designations["designation"]:
+                if _de_designation in main_system_designations:
+                    mdr_de_designations[_de_designation] = _urn
+                    # if correct designation found within set of designations,
+                    # skip for-loop
+                    break
+        return mdr_de_designations
 
-            # add definition template to basetemp
-            de_basetemp["definitions"].append(de_definition_temp)
+    def summarize(self, results: list):
+        self.results = pd.DataFrame(
+            data=results,
+            columns=["designation", "action", "urn", "status_code", "error"]
+        )
+        self.summary = {
+            _action: int((self.results["action"] == _action).sum())
+            for _action in ["created", "updated", "unchanged", "failed"]
+        }
 
-            # create and modify temporary slot list element
-            # (which is actually our dict from the slot_template)
-            create_slot_tmp = copy.deepcopy(
-                self._de_slot_template
+        logging.info(
+            "Created: {created}, updated: {updated}, unchanged: {unchanged}, failed: {failed}".format(
+                **self.summary))
+
+        return self.results
+
+    def upload_row(self, _row: pd.Series, build_request):
+        # create (POST) or update (PUT) the data element of one csv row;
+        # returns the status of this row
+        result, request = self.prepare_row(_row=_row, build_request=build_request)
+        if result is not None:
+            return result
+        return self.send_change(request=request)
+
+    def prepare_row(self, _row: pd.Series, build_request):
+        # returns the result of a row, which is not sent (finished in an
+        # interrupted run or failed), or the request to send
+        result = self.get_journal_result(_row=_row)
+        if result is not None:
+            return result, None
+        try:
+            return None, build_request(_row)
+        except Exception as e:
+            return self.get_failed_result(_row=_row, error=e), None
+
+    def send_change(self, request: dict):
+        # send one built (or planned) request; returns the status of its row
+        try:
+            response = self.write_change(request=request)
+        except Exception as e:
+            return self.get_failed_result(_row=request, error=e)
+        return self.get_response_result(request=request, response=response)
+
+    def write_change(self, request: dict):
+        if request["method"] == "PUT":
+            return self.put_to_api(
+                url=request["url"],
+                data=json_body(request["payload"]),
+                header=self.header
             )
-            create_slot_tmp["name"] = "dqa"
-            create_slot_tmp["value"] = slot_create_dqa_value(
-                mdr=self.database,
-                mdr_row=_row
+        if request["method"] == "POST":
+            return self.post_to_api(
+                url=request["url"],
+                data=json_body(request["payload"]),
+                header=self.header
             )
+        return None
+
+    def get_response_result(self, request: dict, response):
+        return self.get_result(
+            request=request,
+            status_code=None if response is None else response.status_code,
+            text=None if response is None else response.text,
+            location=None if response is None else response.headers.get("Location")
+        )
 
-            # append slot_temp to slots-list
-            de_basetemp["slots"] = de_basetemp["slots"] + [create_slot_tmp]
+    def get_journal_result(self, _row: pd.Series):
+        # rows finished in an interrupted run are not uploaded again
+        if self.journal is None or _row["designation"] not in self.journal.uploaded:
+            return None
+        _done = self.journal.uploaded[_row["designation"]]
+        return {
+            "designation": _row["designation"],
+            "action": _done["action"],
+            "urn": _done["urn"],
+            "status_code": None,
+            "error": None
+        }
 
-            if _designation in mdr_de_designations.keys():
-                # update data element on API (PUT)
-                _urn = mdr_de_designations[_designation]
-                _valuedomainurn = urn_designation_mapping[_urn]["valueDomainUrn"]
-                de_basetemp["valueDomainUrn"] = _valuedomainurn
+    @staticmethod
+    def get_failed_result(_row: pd.Series, error: Exception):
+        logging.error("Upload of dataelement '{}' failed: {}".format(
+            _row["designation"], error))
+        return {
+            "designation": _row["designation"],
+            "action": "failed",
+            "urn": None,
+            "status_code": None,
+            "error": str(error)
+        }
 
-                # get all existing slots but the "dqa"-slot
-                response, ns_dataelement_url = self.get_element_by_urn(
-                    urn=_urn
-                )
-                de_slot_items = [s for s in response["slots"] if s["name"] != "dqa"]
+    def get_result(self, request: dict, status_code: int, text: str, location: str):
+        # status of one uploaded row (also recorded in the journal)
+        result = {
+            "designation": request["designation"],
+            "action": request["action"],
+            "urn": request["urn"],
+            "status_code": status_code,
+            "error": None
+        }
+        if request["method"] is not None:
+            logging.info("Response: {}".format(status_code))
+        if request["action"] == "created":
+            result["urn"] = self.get_created_urn(location)
+
+        if status_code is not None and status_code >= 400:
+            result["action"] = "failed"
+            result["error"] = text
+            logging.error("Upload of dataelement '{}' failed: {} {}".format(
+                request["designation"], status_code, text))
+        elif self.journal is not None:
+            self.journal.record_uploaded(
+                row=result["designation"],
+                action=result["action"],
+                urn=result["urn"]
+            )
+        return result
+
+    def build_request(self, _row: pd.Series, mdr_index: dict,
+                      mdr_de_designations: dict, urn_designation_mapping: dict):
+        # build the request (method, url and payload) to create or update
+        # the data element of one csv row; method is None, if the remote
+        # data element is unchanged
+        _designation = _row["designation"]
+        _definition = _row["definition"]
+
+        logging.info("Dataelement: {}\n\n".format(_designation))
+
+        dqa_value = slot_create_dqa_value(
+            mdr=self.database,
+            mdr_row=_row,
+            mdr_index=mdr_index
+        )
 
-                de_basetemp["slots"] = de_basetemp["slots"] + de_slot_items
+        if _designation in mdr_de_designations.keys():
+            # update data element on API (PUT)
+            _urn = mdr_de_designations[_designation]
+            # keep all existing slots but the "dqa"-slot
+            response = self.element_store.get(urn=_urn)
+            de_basetemp = build_element(
+                ns_urn=self.ns_urn,
+                designation=_designation,
+                definition=_definition,
+                dqa_value=dqa_value,
+                slots=[s for s in response["slots"] if s["name"] != "dqa"]
+            )
+            de_basetemp["valueDomainUrn"] = urn_designation_mapping[_urn]["valueDomainUrn"]
+
+            # skip the PUT (which would create a new version of the
+            # data element), if nothing has changed
+            if self.element_hash(de_basetemp) == self.element_hash(response):
+                logging.info("Dataelement '{}' is unchanged.".format(_urn))
+                return {
+                    "designation": _designation,
+                    "action": "unchanged",
+                    "urn": _urn,
+                    "method": None,
+                    "url": None,
+                    "payload": de_basetemp,
+                    "remote": response
+                }
 
-                element_url = up.urljoin(
-                    self.base_url,
-                    posixpath.join(
-                        "element",
-                        _urn
-                    )
-                )
-                response = requests.put(
-                    url=element_url,
-                    data=json.dumps(de_basetemp),
-                    headers=self.header
+            element_url = up.urljoin(
+                self.base_url,
+                posixpath.join(
+                    "element",
+                    _urn
                 )
+            )
+            return {
+                "designation": _designation,
+                "action": "updated",
+                "urn": _urn,
+                "method": "PUT",
+                "url": element_url,
+                "payload": de_basetemp,
+                "remote": response
+            }
 
-            else:
-                # create new data element on API (POST)
-                # fill valuetype
-                valuedomain_temp = copy.deepcopy(eval(
-                    "self._de_valuedomain_template_" +
-                    _row["variable_type"]
-                ))
-
-                # json.loads()
-                try:
-                    _constraints = json.loads(_row["constraints"])
-
-                    if _row["variable_type"] == "string":
-                        # do some logic here to fill string-specific field in template
-                        valuedomain_temp["text"]["regEx"] = _constraints["regex"]
-                        valuedomain_temp["text"]["useRegEx"] = True
-
-                    elif _row["variable_type"] == "datetime":
-                        # do some logic here to fill datetime-specific field in template
-                        valuedomain_temp["datetime"]["date"] = _constraints["date"]["date"]
-                        valuedomain_temp["datetime"]["time"] = _constraints["date"]["time"]
-                        valuedomain_temp["datetime"]["hourFormat"] = _constraints["date"]["hourFormat"]
-
-                    elif _row["variable_type"] == "enumerated":
-                        # do some logic here to fill enumerated-specific field in template
-                        value_set = _constraints["value_set"].split(
-                            ", ")
-
-                        # init enumerated-form here:
-                        enumerated_value_set = []
-
-                        # loop over value_set
-                        for _val in value_set:
-                            enumerated_value_set.append({
-                                "definitions": [{
-                                    "designation": _val,
-                                    "definition": _val,
-                                    "language": "en"
-                                }],
-                                "value": _val
-                            })
-
-                        valuedomain_temp["permittedValues"] = enumerated_value_set
-
-                    elif _row["variable_type"] in ["float", "integer"]:
-                        valuedomain_temp["numeric"]["type"] = _row["variable_type"].upper(
-                        )
-                        # fill numeric-specific field in template
-                        valuedomain_temp["numeric"]["minimum"] = _constraints["range"]["min"]
-                        valuedomain_temp["numeric"]["maximum"] = _constraints["range"]["max"]
-                        valuedomain_temp["numeric"]["unitOfMeasure"] = _constraints["range"]["unit"]
-
-                        valuedomain_temp["numeric"]["useMinimum"] = True
-                        valuedomain_temp["numeric"]["useMaximum"] = True
-
-                    # add definition template to basetemp
-                    de_basetemp["valueDomain"] = valuedomain_temp
-
-                except Exception as e:
-                    logging.error(e)
-                    valuedomain_temp = copy.deepcopy(
-                        self._de_valuedomain_template_)
-                    valuedomain_temp["text"]["useRegEx"] = False
-                    de_basetemp["valueDomain"] = valuedomain_temp
-
-                element_url = up.urljoin(
-                    self.base_url,
-                    "element"
-                )
-                response = requests.post(
-                    url=element_url,
-                    data=json.dumps(de_basetemp),
-                    headers=self.header
+        else:
+            # create new data element on API (POST)
+            de_basetemp = build_element(
+                ns_urn=self.ns_urn,
+                designation=_designation,
+                definition=_definition,
+                dqa_value=dqa_value
+            )
+            de_basetemp["valueDomain"] = build_valuedomain(
+                variable_type=_row["variable_type"],
+                constraints=_row["constraints"]
+            )
+
+            element_url = up.urljoin(
+                self.base_url,
+                "element"
+            )
+            return {
+                "designation": _designation,
+                "action": "created",
+                "urn": None,
+                "method": "POST",
+                "url": element_url,
+                "payload": de_basetemp,
+                "remote": None
+            }
+
+    @staticmethod
+    def get_created_urn(location: str):
+        # the urn of a newly created element is the last part of its location
+        if location is None:
+            return None
+        return location.rstrip("/").split("/")[-1]
+
+    @staticmethod
+    def normalize_slot_value(value):
+        try:
+            return json_loads(value)
+        except (TypeError, ValueError):
+            return value
+
+    @staticmethod
+    def normalize_element(element: dict):
+        # the fields written by the update, for comparing data elements
+        return {
+            "definitions": {
+                _d.get("language"): {
+                    "designation": _d.get("designation"),
+                    "definition": _d.get("definition")
+                } for _d in element.get("definitions", [])
+            },
+            "slots": {
+                _s.get("name"): UpdateMDR.normalize_slot_value(_s.get("value"))
+                for _s in element.get("slots", [])
+            },
+            "valueDomainUrn": element.get("valueDomainUrn")
+        }
+
+    @staticmethod
+    def element_diff(old, new, field: str = ""):
+        # list of the changed fields (e.g. "slots.dqa.available_systems.
+        # postgres.i2b2.source_table_name") with old and new value
+        if isinstance(old, dict) and isinstance(new, dict):
+            diff = []
+            for _key in sorted(set(old.keys()) | set(new.keys()), key=str):
+                diff += UpdateMDR.element_diff(
+                    old=old.get(_key),
+                    new=new.get(_key),
+                    field=str(_key) if field == "" else "{}.{}".format(field, _key)
                 )
-                logging.info(response)
+            return diff
+        if old != new:
+            return [{"field": field, "old": old, "new": new}]
+        return []
+
+    @staticmethod
+    def element_hash(element: dict):
+        # normalized hash over the fields of a data element, which are
+        # written by the update (definitions, slots and value domain)
+        normalize_slot_value = UpdateMDR.normalize_slot_value
+
+        normalized = {
+            "definitions": sorted(
+                [[_d.get("designation"), _d.get("definition"), _d.get("language")]
+                 for _d in element.get("definitions", [])],
+                key=json.dumps
+            ),
+            "slots": sorted(
+                [[_s.get("name"), normalize_slot_value(_s.get("value"))]
+                 for _s in element.get("slots", [])],
+                key=json.dumps
+            ),
+            "valueDomainUrn": element.get("valueDomainUrn")
+        }
+        return hashlib.sha256(
+            json.dumps(normalized, sort_keys=True).encode("utf-8")).hexdigest()
 
-    def read_csv_mdr(self, separator: str):
+    def read_csv_mdr(self, separator: str, chunksize: int = 100000):
         if separator not in [";", ","]:
             msg = "Separator of CSV-file must be ';' or ','"
             logging.error(msg)
             raise Exception(msg)
-        self.database = pd.read_csv(
+        # empty fields are kept as "" (they are written to the dqa slot)
+        self.csv_columns = []
+        with pd.read_csv(
             filepath_or_buffer=self.csv_file_name,
             sep=separator,
-            keep_default_na=False
+            keep_default_na=False,
+            dtype=str,
+            chunksize=chunksize
+        ) as reader:
+            chunks = []
+            for _chunk in reader:
+                if len(chunks) == 0:
+                    # columns of the file (the schema adds missing ones)
+                    self.csv_columns = list(_chunk.columns)
+                chunks.append(mdr_apply_schema(_chunk))
+        self.database = mdr_concat(chunks)
+
+    def validate_mdr(self, main_system_name: str, main_system_type: str):
+        # report all problems of the csv file at once
+        problems = mdr_validate(
+            mdr=self.database[[_col for _col in self.database.columns
+                               if _col in self.csv_columns]],
+            main_system_name=main_system_name,
+            main_system_type=main_system_type,
+            variable_types=get_variable_types()
         )
+        if len(problems) > 0:
+            msg = "The csv file '{}' is not valid:\n{}".format(
+                self.csv_file_name, "\n".join(problems))
+            logging.error(msg)
+            raise Exception(msg)
 
-    @staticmethod
-    def post_to_api(url, data, header):
+    def post_to_api(self, url, data, header):
         logging.info("API post: {}".format(url))
-        r = requests.post(
-            url=url,
-            data=data,
-            headers=header
-        )
+        try:
+            r = self.send_request(
+                method="POST",
+                url=url,
+                data=data,
+                headers=header
+            )
+        finally:
+            self.invalidate_written(url=url)
         return r
 
-    def init_template_elements(self):
-
-        self._de_definition_json_template = {
-            "designation": [],
-            "definition": [],
-            "language": "en"
-        }
-
-        self._de_valuedomain_template_string = {
-            "type": "STRING",
-            "text": {
-                "useRegEx": "",
-                "regEx": "",
-                "useMaximumLength": True,
-                "maximumLength": int()
-            }
-        }
-
-        # use "string", when no "variable_type" defined
-        self._de_valuedomain_template_ = self._de_valuedomain_template_string
-
-        # update datetime template correctly #done
-        # above: fill correctly with info from csv
-        self._de_valuedomain_template_datetime = {
-            "type": "DATETIME",
-            "datetime": {
-                "date": "",
-                "time": "",
-                "hourFormat": ""
-            }
-        }
-
-        # update enumerated template correctly #not possible in current status
-        # above: fill correctly with info from csv
-        self._de_valuedomain_template_enumerated = {
-            "type": "ENUMERATED",
-            "permittedValues": ""
-        }
-
-        # update float template correctly
-        # above: fill correctly with info from csv
-        self._de_valuedomain_template_float = {
-            "type": "NUMERIC",
-            "numeric": {
-                "type": "",
-                "useMinimum": "",  # bool
-                "useMaximum": "",  # bool
-                "unitOfMeasure": "",  # string
-                "minimum": "",  # numeric/float
-                "maximum": ""  # numeric/float
-            }
-        }
-
-        self._de_valuedomain_template_integer = self._de_valuedomain_template_float
-
-        self._de_slot_template = {
-            "name": "",
-            "value": ""
-        }
-
-    def init_templates(self):
-        # init template elements
-        self.init_template_elements()
+    def put_to_api(self, url, data, header):
+        logging.info("API put: {}".format(url))
+        try:
+            r = self.send_request(
+                method="PUT",
+                url=url,
+                data=data,
+                headers=header
+            )
+        finally:
+            self.invalidate_written(url=url)
+        return r
 
-        # data element template
-        self._de_json_template = {
-            "identification": {
-                "elementType": "DATAELEMENT",
-                "namespaceUrn": "",
-                "status": "RELEASED"
-            },
-            "definitions": [],
-            "slots": [],
-            "conceptAssociations": []
-        }
+    def invalidate_written(self, url):
+        # drop the cached responses, which change by writing to 'url': the
+        # url itself (e.g. the element or the namespace listing) and the
+        # members of the namespace (new elements, new revisions)
+        self.invalidate_cache(url=url)
+        if self.ns_id is not None:
+            self.invalidate_cache(url=self.get_namespace_members_url(ns_id=self.ns_id))
@@ -51,5 +51,11 @@ setup(
     copyright="Universitätsklinikum Erlangen",
     packages=find_packages(exclude=['test', 'test.*']),
     install_requires=install_reqs,
+    extras_require={
+        "async": ["aiohttp"],
+        "token-cache": ["cryptography"],
+        "parquet": ["pyarrow"],
+        "fast-json": ["orjson"]
+    },
     dependency_links=[],
 )